@@ -0,0 +1,81 @@
+import json
+import logging
+import asyncio
+import random
+import discord
+from typing import List, Optional, Tuple
+import async_db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Discord accepte au plus 10 embeds par message
+MAX_EMBEDS_PER_MESSAGE = 10
+# Délai laissé aux annonces d'une même rafale pour être regroupées (en secondes)
+COALESCE_DELAY = 2
+MAX_BACKOFF = 300
+
+class Announcer:
+    """File d'envoi des annonces Discord, indépendante de la boucle de sondage
+
+    Chaque annonce est enregistrée en base avant d'être mise en file : celles
+    qui n'ont pas pu être envoyées sont reprises au redémarrage. Les rafales
+    sont regroupées en un seul message de 10 embeds maximum.
+    """
+
+    def __init__(self, client: discord.Client, channel_id: int):
+        self.client = client
+        self.channel_id = channel_id
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._queue = asyncio.Queue()
+        # Reprise des annonces non envoyées lors de la dernière exécution
+        pending = await async_db.get_pending_announcements()
+        for announcement_id, payload in pending:
+            self._queue.put_nowait((announcement_id, discord.Embed.from_dict(json.loads(payload))))
+        if pending:
+            logger.info("%d annonces en attente reprises", len(pending))
+        self._task = asyncio.create_task(self._run())
+
+    async def announce(self, embed: discord.Embed):
+        announcement_id = await async_db.add_pending_announcement(json.dumps(embed.to_dict()))
+        self._queue.put_nowait((announcement_id, embed))
+
+    async def _next_batch(self) -> List[Tuple[int, discord.Embed]]:
+        batch = [await self._queue.get()]
+        await asyncio.sleep(COALESCE_DELAY)
+        while len(batch) < MAX_EMBEDS_PER_MESSAGE and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _send(self, batch: List[Tuple[int, discord.Embed]]):
+        delay = 1
+        while True:
+            channel = self.client.get_channel(self.channel_id)
+            try:
+                if not channel:
+                    raise RuntimeError("channel Discord introuvable")
+                with metrics.discord_send_duration.time(kind='announcement'):
+                    await channel.send(embeds=[embed for _, embed in batch])
+                metrics.discord_sends.inc(kind='announcement', result='ok')
+                await async_db.delete_pending_announcements([announcement_id for announcement_id, _ in batch])
+                return
+            except (discord.Forbidden, discord.NotFound) as e:
+                # Erreur définitive : les annonces restent en base pour le prochain démarrage
+                metrics.discord_sends.inc(kind='announcement', result='error')
+                logger.error("Envoi des annonces impossible: %s", e)
+                return
+            except Exception as e:
+                metrics.discord_sends.inc(kind='announcement', result='retry')
+                logger.warning("Échec de l'envoi de %d annonces, nouvel essai dans %ss: %s", len(batch), delay, e)
+            await asyncio.sleep(delay * random.uniform(0.5, 1))
+            delay = min(delay * 2, MAX_BACKOFF)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._send(batch)
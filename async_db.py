@@ -0,0 +1,43 @@
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+import db
+import metrics
+
+# Version asynchrone de db.py : chaque appel est exécuté dans un thread dédié
+# pour ne pas bloquer la boucle de discord.py sur les accès disque.
+# Un seul thread, donc une seule connexion SQLite et des écritures sérialisées.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+def _timed(func, *args, **kwargs):
+    # Mesuré dans le thread de la base : durée de la requête, hors attente dans la file
+    try:
+        with metrics.db_operation_duration.time(operation=func.__name__):
+            return func(*args, **kwargs)
+    except Exception:
+        metrics.db_operation_errors.inc(operation=func.__name__)
+        raise
+
+async def run(func, *args, **kwargs):
+    """Exécute une fonction synchrone de db.py dans le thread de la base"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_timed, func, *args, **kwargs))
+
+def close():
+    """Ferme la connexion du thread de la base puis arrête ce thread (à l'arrêt du bot)"""
+    _executor.submit(db.close_connection).result()
+    _executor.shutdown()
+
+def __getattr__(name):
+    # async_db.get_todo() -> await run(db.get_todo)
+    func = getattr(db, name, None)
+    if not inspect.isfunction(func) or func.__module__ != db.__name__ or name.startswith('_'):
+        raise AttributeError(f"module 'async_db' has no attribute '{name}'")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+
+    globals()[name] = wrapper
+    return wrapper
@@ -1,11 +1,67 @@
+import time
+import random
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from models import Activity, Challenge, Fortress, Machine
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = Path("data/bot.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# Nombre de requêtes préparées conservées par connexion
+STATEMENT_CACHE_SIZE = 256
+
+# Une connexion persistante par thread, sqlite3 interdisant le partage entre threads
+_local = threading.local()
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        # Reporte le WAL dans la base avant fermeture pour ne laisser aucun -wal derrière
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction():
+    """Regroupe plusieurs écritures dans un seul commit (rollback en cas d'erreur)"""
+    conn = get_connection()
+    with conn:
+        yield conn.cursor()
+
+def _execute(query, params=()):
+    with transaction() as c:
+        c.execute(query, params)
+
+def _executemany(query, rows):
+    with transaction() as c:
+        c.executemany(query, rows)
+
+def _fetchall(query, params=()):
+    return get_connection().execute(query, params).fetchall()
+
+def _add_column_if_missing(c, table, column, definition):
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in c.fetchall()}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Migrations du schéma, appliquées dans l'ordre au démarrage. La version atteinte
+# est stockée dans PRAGMA user_version ; chaque étape reste idempotente car les
+# bases créées avant son introduction peuvent déjà contenir une partie du schéma.
+
+def _migration_base_schema(c):
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id TEXT PRIMARY KEY,
         name TEXT
@@ -52,134 +108,299 @@ def init_db():
         htb_id TEXT,
         name TEXT
     )''')
-    conn.commit()
-    conn.close()
-
-def add_or_update_user(user_id, name):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO users (id, name) VALUES (?, ?)", (user_id, name))
-    conn.commit()
-    conn.close()
-
-def add_or_update_challenge(challenge_id, name, difficulty, points, category):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO challenges (id, name, difficulty, points, challenge_category) VALUES (?, ?, ?, ?, ?)",
-              (challenge_id, name, difficulty, points, category))
-    conn.commit()
-    conn.close()
-
-def add_or_update_machine(machine_id, name, difficulty, points, os):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO machines (id, name, difficulty, points, os) VALUES (?, ?, ?, ?, ?)",
-              (machine_id, name, difficulty, points, os))
-    conn.commit()
-    conn.close()
-
-def add_or_update_fortress(fortress_id, name, points, number_of_flags):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO fortresses (id, name, points, number_of_flags) VALUES (?, ?, ?, ?)",
-              (fortress_id, name, points, number_of_flags))
-    conn.commit()
-    conn.close()
+
+def _migration_user_profile(c):
+    _add_column_if_missing(c, 'users', 'rank', 'TEXT')
+    _add_column_if_missing(c, 'users', 'avatar', 'TEXT')
+
+def _migration_difficulty_and_category_age(c):
+    _add_column_if_missing(c, 'challenges', 'difficulty_score', 'INTEGER')
+    _add_column_if_missing(c, 'challenges', 'category_updated_at', 'INTEGER')
+    _add_column_if_missing(c, 'machines', 'difficulty_score', 'INTEGER')
+
+def _migration_activity_cursors(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS activity_cursors (
+        user_id TEXT PRIMARY KEY,
+        object_type TEXT,
+        object_id TEXT,
+        flag_type TEXT,
+        date TEXT
+    )''')
+
+def _migration_monitor_messages(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS monitor_messages (
+        category TEXT PRIMARY KEY,
+        message_id INTEGER
+    )''')
+    _add_column_if_missing(c, 'monitor_messages', 'content_hash', 'TEXT')
+
+def _migration_pending_announcements(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS pending_announcements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT,
+        created_at INTEGER
+    )''')
+
+def _migration_todo_primary_key(c):
+    # Table groupée sur sa clé (type, htb_id) : les recherches par type ou
+    # par (type, id) se font directement dans la clé primaire.
+    # Les anciennes tables todo n'ont pas de clé primaire (et potentiellement des doublons)
+    c.execute("PRAGMA table_info(todo)")
+    if any(row[5] for row in c.fetchall()):
+        return
+    c.execute("ALTER TABLE todo RENAME TO todo_old")
+    c.execute('''CREATE TABLE todo (
+        type TEXT NOT NULL,
+        htb_id TEXT NOT NULL,
+        name TEXT,
+        PRIMARY KEY (type, htb_id)
+    ) WITHOUT ROWID''')
+    c.execute("INSERT OR IGNORE INTO todo (type, htb_id, name) SELECT type, htb_id, name FROM todo_old WHERE type IS NOT NULL AND htb_id IS NOT NULL")
+    c.execute("DROP TABLE todo_old")
+
+def _migration_stale_category_index(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_challenges_stale ON challenges (category_updated_at)")
+
+def _migration_activity_store(c):
+    # Toutes les activités connues des membres, une ligne par flag : la clé primaire
+    # dédoublonne les réponses successives, l'index répond à « quelqu'un l'a-t-il déjà fait ? »
+    c.execute('''CREATE TABLE IF NOT EXISTS activity (
+        user_id TEXT NOT NULL,
+        object_type TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        flag_type TEXT NOT NULL DEFAULT '',
+        name TEXT,
+        points INTEGER,
+        date TEXT,
+        challenge_category TEXT,
+        PRIMARY KEY (user_id, object_type, object_id, flag_type)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_activity_object ON activity (object_type, object_id, flag_type, date)")
+
+# Ne jamais réordonner ni supprimer une étape : ajouter les nouvelles à la fin
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_user_profile,
+    _migration_difficulty_and_category_age,
+    _migration_activity_cursors,
+    _migration_monitor_messages,
+    _migration_pending_announcements,
+    _migration_todo_primary_key,
+    _migration_stale_category_index,
+    _migration_activity_store,
+]
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """Applique les migrations manquantes, chacune dans sa propre transaction"""
+    conn = get_connection()
+    version = get_schema_version()
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            # BEGIN explicite : sqlite3 n'ouvre pas de transaction pour les ordres DDL
+            c = conn.cursor()
+            c.execute("BEGIN")
+            migration(c)
+            c.execute(f"PRAGMA user_version = {target}")
+        logger.info("Migration %d appliquée (%s)", target, migration.__name__)
+
+def add_or_update_user(user_id, name, rank='', avatar=''):
+    bulk_upsert_users([(user_id, name, rank, avatar)])
+
+def add_or_update_challenge(challenge: Challenge):
+    bulk_upsert_challenges([challenge])
+
+def add_or_update_machine(machine: Machine):
+    bulk_upsert_machines([machine])
+
+def add_or_update_fortress(fortress: Fortress):
+    bulk_upsert_fortresses([fortress])
+
+def bulk_upsert_users(rows):
+    _executemany("INSERT OR REPLACE INTO users (id, name, rank, avatar) VALUES (?, ?, ?, ?)", rows)
+
+def get_all_users():
+    return _fetchall("SELECT id, name, COALESCE(rank, ''), COALESCE(avatar, '') FROM users")
+
+def remove_users(user_ids):
+    """Supprime des membres ayant quitté l'université, avec leur activité"""
+    rows = [(user_id,) for user_id in user_ids]
+    with transaction() as c:
+        c.executemany("DELETE FROM activity WHERE user_id = ?", rows)
+        c.executemany("DELETE FROM activity_cursors WHERE user_id = ?", rows)
+        c.executemany("DELETE FROM users WHERE id = ?", rows)
+
+def bulk_upsert_challenges(challenges):
+    # Une catégorie à None conserve celle déjà enregistrée
+    _executemany('''INSERT INTO challenges (id, name, difficulty, difficulty_score, points, challenge_category)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET name = excluded.name, difficulty = excluded.difficulty,
+        difficulty_score = excluded.difficulty_score, points = excluded.points,
+        challenge_category = COALESCE(excluded.challenge_category, challenges.challenge_category)''',
+        [(c.id, c.name, c.difficulty, c.difficulty_score, c.points, c.category) for c in challenges])
+
+def bulk_update_challenge_categories(rows, jitter=0):
+    """Enregistre les catégories rafraîchies ; chaque date est avancée d'un décalage
+    aléatoire d'au plus jitter secondes pour étaler les expirations suivantes"""
+    now = int(time.time())
+    _executemany("UPDATE challenges SET challenge_category = ?, category_updated_at = ? WHERE id = ?",
+                 [(category, now - random.randint(0, jitter), challenge_id) for challenge_id, category in rows])
+
+def get_stale_challenge_ids(max_age):
+    rows = _fetchall("SELECT id FROM challenges WHERE category_updated_at IS NULL OR category_updated_at < ?",
+                     (int(time.time()) - max_age,))
+    return [row[0] for row in rows]
+
+def bulk_upsert_machines(machines):
+    _executemany("INSERT OR REPLACE INTO machines (id, name, difficulty, difficulty_score, points, os) VALUES (?, ?, ?, ?, ?, ?)",
+                 [(m.id, m.name, m.difficulty, m.difficulty_score, m.points, m.os) for m in machines])
+
+def bulk_upsert_fortresses(fortresses):
+    _executemany("INSERT OR REPLACE INTO fortresses (id, name, points, number_of_flags) VALUES (?, ?, ?, ?)",
+                 [(f.id, f.name, f.points, f.flags) for f in fortresses])
 
 def add_challenge_completion(user_id, challenge_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO challenge_completions (user_id, challenge_id) VALUES (?, ?)", (user_id, challenge_id))
-    conn.commit()
-    conn.close()
+    _execute("INSERT OR IGNORE INTO challenge_completions (user_id, challenge_id) VALUES (?, ?)", (user_id, challenge_id))
 
 def add_machine_flag(user_id, machine_id, flag_type):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO machine_flags (user_id, machine_id, flag_type) VALUES (?, ?, ?)", (user_id, machine_id, flag_type))
-    conn.commit()
-    conn.close()
+    _execute("INSERT OR IGNORE INTO machine_flags (user_id, machine_id, flag_type) VALUES (?, ?, ?)", (user_id, machine_id, flag_type))
 
 def add_fortress_flag(user_id, fortress_id, flag_title):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO fortress_flags (user_id, fortress_id, flag_title) VALUES (?, ?, ?)", (user_id, fortress_id, flag_title))
-    conn.commit()
-    conn.close()
+    _execute("INSERT OR IGNORE INTO fortress_flags (user_id, fortress_id, flag_title) VALUES (?, ?, ?)", (user_id, fortress_id, flag_title))
+
+def get_activity_cursors():
+    rows = _fetchall("SELECT user_id, object_type, object_id, flag_type, date FROM activity_cursors")
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def bulk_set_activity_cursors(rows):
+    _executemany("INSERT OR REPLACE INTO activity_cursors (user_id, object_type, object_id, flag_type, date) VALUES (?, ?, ?, ?, ?)", rows)
+
+def bulk_add_activities(user_id, activities):
+    """Enregistre les activités d'un membre ; celles déjà connues sont ignorées"""
+    _executemany('''INSERT OR IGNORE INTO activity (user_id, object_type, object_id, flag_type, name, points,
+        date, challenge_category) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        [(user_id, a.object_type, a.id, a.type, a.name, a.points, a.date, a.challenge_category) for a in activities])
+
+def get_activity_user_ids():
+    """Membres dont l'historique d'activité est déjà en base"""
+    return {row[0] for row in _fetchall("SELECT DISTINCT user_id FROM activity")}
+
+def is_solved(object_type, object_id, flag_type, before=None, exclude_user=None):
+    """Indique si un membre (autre que exclude_user) a déjà ce flag, avant la date before si donnée"""
+    query = "SELECT 1 FROM activity WHERE object_type = ? AND object_id = ? AND flag_type = ?"
+    params = [object_type, object_id, flag_type]
+    if before is not None:
+        query += " AND date < ?"
+        params.append(before)
+    if exclude_user is not None:
+        query += " AND user_id != ?"
+        params.append(exclude_user)
+    return bool(_fetchall(query + " LIMIT 1", params))
+
+def get_last_activity_dates():
+    """Date de la dernière activité connue de chaque membre"""
+    return dict(_fetchall("SELECT user_id, MAX(date) FROM activity GROUP BY user_id"))
+
+def get_solved_activities():
+    """Première activité de l'université pour chaque flag"""
+    rows = _fetchall('''SELECT object_type, object_id, flag_type, name, points, MIN(date), challenge_category
+        FROM activity GROUP BY object_type, object_id, flag_type''')
+    return [Activity(*row) for row in rows]
 
 def get_challenge_completions(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT challenge_id FROM challenge_completions WHERE user_id = ?", (user_id,))
-    completions = [row[0] for row in c.fetchall()]
-    conn.close()
-    return completions
+    return [row[0] for row in _fetchall("SELECT challenge_id FROM challenge_completions WHERE user_id = ?", (user_id,))]
 
 def get_machine_flags(user_id, machine_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT flag_type FROM machine_flags WHERE user_id = ? AND machine_id = ?", (user_id, machine_id))
-    flags = [row[0] for row in c.fetchall()]
-    conn.close()
-    return flags
+    return [row[0] for row in _fetchall("SELECT flag_type FROM machine_flags WHERE user_id = ? AND machine_id = ?", (user_id, machine_id))]
 
 def get_fortress_flags(user_id, fortress_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT flag_title FROM fortress_flags WHERE user_id = ? AND fortress_id = ?", (user_id, fortress_id))
-    flags = [row[0] for row in c.fetchall()]
-    conn.close()
-    return flags
+    return [row[0] for row in _fetchall("SELECT flag_title FROM fortress_flags WHERE user_id = ? AND fortress_id = ?", (user_id, fortress_id))]
 
 def get_all_challenges():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, difficulty, points, challenge_category FROM challenges")
-    challenges = c.fetchall()
-    conn.close()
-    return challenges
+    rows = _fetchall("SELECT id, name, difficulty, COALESCE(difficulty_score, 0), points, challenge_category FROM challenges")
+    return [Challenge(*row) for row in rows]
 
 def get_all_machines():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, difficulty, points, os FROM machines")
-    machines = c.fetchall()
-    conn.close()
-    return machines
+    rows = _fetchall("SELECT id, name, difficulty, COALESCE(difficulty_score, 0), points, os FROM machines")
+    return [Machine(*row) for row in rows]
 
 def get_all_fortresses():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, points, number_of_flags FROM fortresses")
-    fortresses = c.fetchall()
-    conn.close()
-    return fortresses
+    return [Fortress(*row) for row in _fetchall("SELECT id, name, points, number_of_flags FROM fortresses")]
 
 def clear_todo():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM todo")
-    conn.commit()
-    conn.close()
+    _execute("DELETE FROM todo")
 
 def add_todo(type, htb_id, name):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO todo (type, htb_id, name) VALUES (?, ?, ?)", (type, htb_id, name))
-    conn.commit()
-    conn.close()
+    bulk_add_todo([(type, htb_id, name)])
+
+def bulk_add_todo(rows):
+    _executemany("INSERT OR REPLACE INTO todo (type, htb_id, name) VALUES (?, ?, ?)", rows)
 
 def remove_todo(type, htb_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM todo WHERE type = ? AND htb_id = ?", (type, htb_id))
-    conn.commit()
-    conn.close()
+    _execute("DELETE FROM todo WHERE type = ? AND htb_id = ?", (type, htb_id))
 
 def get_todo():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT type, htb_id, name FROM todo")
-    todos = c.fetchall()
-    conn.close()
-    return todos
\ No newline at end of file
+    return _fetchall("SELECT type, htb_id, name FROM todo")
+
+def is_todo(type, htb_id):
+    return bool(_fetchall("SELECT 1 FROM todo WHERE type = ? AND htb_id = ?", (type, htb_id)))
+
+def count_todo():
+    return dict(_fetchall("SELECT type, COUNT(*) FROM todo GROUP BY type"))
+
+def todo_with_details(type):
+    """Entrées todo d'un type avec leur fiche (Challenge, Machine, Fortress ou None si inconnue)"""
+    if type == 'challenge':
+        rows = _fetchall('''SELECT t.htb_id, t.name, c.id, c.name, c.difficulty, COALESCE(c.difficulty_score, 0),
+            c.points, c.challenge_category FROM todo t LEFT JOIN challenges c ON c.id = t.htb_id
+            WHERE t.type = ?''', (type,))
+        record = Challenge
+    elif type in ('machine_user', 'machine_root'):
+        rows = _fetchall('''SELECT t.htb_id, t.name, m.id, m.name, m.difficulty, COALESCE(m.difficulty_score, 0),
+            m.points, m.os FROM todo t LEFT JOIN machines m ON m.id = t.htb_id
+            WHERE t.type = ?''', (type,))
+        record = Machine
+    elif type == 'fortress':
+        rows = _fetchall('''SELECT t.htb_id, t.name, f.id, f.name, f.points, f.number_of_flags
+            FROM todo t LEFT JOIN fortresses f ON f.id = t.htb_id
+            WHERE t.type = ?''', (type,))
+        record = Fortress
+    else:
+        raise ValueError(f"type de todo inconnu: {type}")
+    return [(row[0], row[1], record(*row[2:]) if row[2] is not None else None) for row in rows]
+
+def reconcile_todo(entries):
+    """Synchronise la table todo par différence, en une seule transaction"""
+    desired = {(type, htb_id): name for type, htb_id, name in entries}
+    with transaction() as c:
+        c.execute("SELECT type, htb_id, name FROM todo")
+        current = {(type, htb_id): name for type, htb_id, name in c.fetchall()}
+        to_delete = list(current.keys() - desired.keys())
+        to_insert = [(type, htb_id, desired[(type, htb_id)]) for type, htb_id in desired.keys() - current.keys()]
+        to_rename = [(name, type, htb_id) for (type, htb_id), name in desired.items()
+                     if (type, htb_id) in current and current[(type, htb_id)] != name]
+        c.executemany("DELETE FROM todo WHERE type = ? AND htb_id = ?", to_delete)
+        c.executemany("INSERT INTO todo (type, htb_id, name) VALUES (?, ?, ?)", to_insert)
+        c.executemany("UPDATE todo SET name = ? WHERE type = ? AND htb_id = ?", to_rename)
+    return len(to_insert), len(to_delete)
+
+def get_monitor_messages():
+    rows = _fetchall("SELECT category, message_id, content_hash FROM monitor_messages")
+    return {category: (message_id, content_hash) for category, message_id, content_hash in rows}
+
+def set_monitor_message(category, message_id, content_hash):
+    _execute("INSERT OR REPLACE INTO monitor_messages (category, message_id, content_hash) VALUES (?, ?, ?)",
+             (category, message_id, content_hash))
+
+def add_pending_announcement(payload):
+    with transaction() as c:
+        c.execute("INSERT INTO pending_announcements (payload, created_at) VALUES (?, ?)", (payload, int(time.time())))
+        return c.lastrowid
+
+def get_pending_announcements():
+    return _fetchall("SELECT id, payload FROM pending_announcements ORDER BY id")
+
+def delete_pending_announcements(ids):
+    _executemany("DELETE FROM pending_announcements WHERE id = ?", [(announcement_id,) for announcement_id in ids])
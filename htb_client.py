@@ -0,0 +1,247 @@
+import os
+import time
+import logging
+import random
+import weakref
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+import http_cache
+import metrics
+from rate_limiter import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Client HTTP partagé pour toutes les requêtes vers l'API HTB
+HTB_API_TOKEN = os.environ.get('HTB_API_TOKEN')
+
+LABS_API = "https://labs.hackthebox.com/api/v4"
+WWW_API = "https://www.hackthebox.com/api/v4"
+
+# Le Host est positionné par aiohttp en fonction de l'URL (labs ou www)
+headers = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:139.0) Gecko/20100101 Firefox/139.0",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate",
+    "Authorization": f"Bearer {HTB_API_TOKEN}",
+    "Origin": "https://app.hackthebox.com",
+    "Connection": "keep-alive",
+    "Referer": "https://app.hackthebox.com/",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-site"
+}
+
+# Paramètres du pool de connexions
+TIMEOUT = aiohttp.ClientTimeout(total=10, connect=5)
+MAX_CONNECTIONS = 20
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+# Débit global vers l'API HTB, partagé par tous les appelants et ajusté selon les 429
+REQUESTS_PER_SECOND = float(os.environ.get('HTB_REQUESTS_PER_SECOND', '3'))
+MAX_REQUESTS_PER_SECOND = float(os.environ.get('HTB_MAX_REQUESTS_PER_SECOND', '10'))
+BURST = 5
+MAX_THROTTLE_RETRIES = 3
+
+# Durée pendant laquelle une réponse en cache est servie sans revalidation (en secondes)
+CATALOGUE_TTL = 3600
+MEMBERS_TTL = 60
+
+# Nombre maximal de requêtes simultanées lancées par gather_limited
+MAX_CONCURRENCY = 8
+limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND, BURST, max_rate=MAX_REQUESTS_PER_SECOND)
+
+_session: Optional[aiohttp.ClientSession] = None
+_url_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def get_session() -> aiohttp.ClientSession:
+    """Retourne la session partagée, créée à la première utilisation"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(headers=headers, timeout=TIMEOUT, connector=connector)
+    return _session
+
+async def close():
+    """Ferme la session partagée et libère les connexions du pool"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def _endpoint(url: str) -> str:
+    """Chemin de l'URL sans préfixe d'API ni identifiants, pour borner le nombre de labels"""
+    path = urlsplit(url).path
+    if path.startswith('/api/v4'):
+        path = path[len('/api/v4'):]
+    return '/'.join(':id' if part.isdigit() else part for part in path.split('/'))
+
+async def _fetch(url: str, retries: int, delay: float,
+                 extra_headers: Optional[Dict[str, str]] = None) -> Optional[Tuple[int, Mapping[str, str], Any]]:
+    """Effectue un GET et retourne (statut, en-têtes, JSON) pour un 200 ou un 304
+
+    Les 429 sont confiés au limiteur qui applique Retry-After, les erreurs
+    serveur et réseau sont réessayées avec un backoff exponentiel.
+    """
+    session = get_session()
+    endpoint = _endpoint(url)
+    attempt = 0
+    throttled = 0
+    while attempt < retries:
+        await limiter.acquire()
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=extra_headers) as resp:
+                status = resp.status
+                if resp.status == 200:
+                    limiter.on_success(resp.headers)
+                    return resp.status, resp.headers, await resp.json(content_type=None)
+                if resp.status == 304:
+                    limiter.on_success(resp.headers)
+                    return resp.status, resp.headers, None
+                if resp.status == 429:
+                    limiter.on_throttle(resp.headers)
+                    logger.warning("Limite de débit atteinte pour %s, nouveau débit %.2f req/s", url, limiter.rate)
+                    # Un 429 ne compte pas comme une tentative, dans la limite de MAX_THROTTLE_RETRIES
+                    throttled += 1
+                    if throttled > MAX_THROTTLE_RETRIES:
+                        return None
+                    continue
+                logger.error("Statut HTTP %d pour %s", resp.status, url)
+                if resp.status < 500:
+                    return None
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.error("Timeout pour la requête vers %s", url)
+        except aiohttp.ClientError as e:
+            logger.warning("Tentative %d échouée pour %s: %s", attempt + 1, url, e)
+        except ValueError as e:
+            # Corps non JSON malgré un 200 (page d'erreur HTML d'un proxy, par exemple)
+            status = 'error'
+            logger.error("Réponse invalide pour %s: %s", url, e)
+            return None
+        finally:
+            metrics.htb_request_duration.observe(time.perf_counter() - start, endpoint=endpoint)
+            metrics.htb_requests.inc(endpoint=endpoint, status=status)
+            metrics.htb_rate_limit.set(limiter.rate)
+        attempt += 1
+        if attempt < retries:
+            await asyncio.sleep(delay * 2 ** (attempt - 1) * random.uniform(0.5, 1))
+    return None
+
+async def get_json(url: str, retries: int = 1, delay: float = 2) -> Optional[Any]:
+    """Effectue un GET et retourne le JSON décodé, ou None en cas d'échec"""
+    result = await _fetch(url, retries, delay)
+    return result[2] if result is not None else None
+
+def _url_lock(url: str) -> asyncio.Lock:
+    # Un verrou par URL, libéré automatiquement quand plus personne ne l'attend
+    lock = _url_locks.get(url)
+    if lock is None:
+        lock = _url_locks[url] = asyncio.Lock()
+    return lock
+
+async def get_json_cached(url: str, ttl: float, retries: int = 1, delay: float = 2) -> Optional[Any]:
+    """Comme get_json, mais en s'appuyant sur le cache disque de http_cache
+
+    Tant que le TTL n'est pas expiré, aucune requête n'est faite ; ensuite la
+    réponse est revalidée par une requête conditionnelle (ETag / Last-Modified).
+    En cas d'échec, la dernière version connue est retournée. Les appels
+    simultanés sur une même URL attendent la première requête au lieu d'en
+    lancer une autre.
+    """
+    async with _url_lock(url):
+        # Le corps est relu sur disque hors de la boucle, seules les métadonnées restent en mémoire
+        cached = await asyncio.to_thread(http_cache.load, url)
+        entry, body = cached if cached is not None else (None, None)
+        if entry is not None and time.time() - entry.fetched_at < ttl:
+            metrics.htb_cache.inc(result='fresh')
+            return body
+        conditional = {}
+        if entry is not None:
+            if entry.etag:
+                conditional['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                conditional['If-Modified-Since'] = entry.last_modified
+        result = await _fetch(url, retries, delay, conditional or None)
+        if result is None:
+            if entry is not None:
+                logger.warning("Utilisation de la version en cache pour %s", url)
+                metrics.htb_cache.inc(result='stale')
+                return body
+            return None
+        status, response_headers, data = result
+        if status == 304 and entry is not None:
+            metrics.htb_cache.inc(result='revalidated')
+            entry.fetched_at = time.time()
+            return body
+        entry = http_cache.CacheEntry(
+            url=url,
+            fetched_at=time.time(),
+            etag=response_headers.get('ETag'),
+            last_modified=response_headers.get('Last-Modified')
+        )
+        await asyncio.to_thread(http_cache.save, entry, data)
+        return data
+
+# Marque la fin des éléments dans iter_limited
+_END = object()
+
+def _limited(func: Callable[[Any], Awaitable[Any]], limit: int) -> Callable[[Any], Awaitable[Any]]:
+    """Borne la concurrence de func et remplace ses exceptions par None pour l'élément concerné"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return await func(item)
+            except Exception:
+                logger.exception("Échec du traitement de %r", item)
+                return None
+
+    return run
+
+async def gather_limited(func: Callable[[Any], Awaitable[Any]], items: Iterable[Any],
+                         limit: int = MAX_CONCURRENCY) -> List[Any]:
+    """Applique func à chaque élément en parallèle, au plus limit à la fois
+
+    Les résultats sont retournés dans l'ordre des éléments ; le débit global
+    reste borné par le limiteur partagé. Un élément en échec donne None sans
+    interrompre les autres.
+    """
+    run = _limited(func, limit)
+    return await asyncio.gather(*(run(item) for item in items))
+
+async def iter_limited(func: Callable[[Any], Awaitable[Any]], items: Iterable[Any],
+                       limit: int = MAX_CONCURRENCY) -> AsyncIterator[Any]:
+    """Comme gather_limited, mais génère les résultats dans leur ordre d'arrivée
+
+    Un nouvel élément n'est lancé qu'une fois un résultat consommé : au plus limit
+    résultats sont en cours ou en attente de lecture à un instant donné.
+    """
+    run = _limited(func, limit)
+    items = iter(items)
+    pending = set()
+    try:
+        while True:
+            while len(pending) < limit:
+                item = next(items, _END)
+                if item is _END:
+                    break
+                pending.add(asyncio.ensure_future(run(item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+import tempfile
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+# Cache disque des réponses de l'API HTB (corps + métadonnées de revalidation)
+CACHE_DIR = Path("data/http_cache")
+
+@dataclass
+class CacheEntry:
+    url: str
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Empreinte du corps, pour savoir s'il a changé sans le comparer
+    digest: Optional[str] = None
+
+# Seules les métadonnées restent en mémoire : les corps (catalogue complet,
+# pages de machines...) sont relus sur disque à la demande
+_entries: Dict[str, CacheEntry] = {}
+
+def _path(url: str) -> Path:
+    return CACHE_DIR / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+def get_entry(url: str) -> Optional[CacheEntry]:
+    """Métadonnées déjà connues en mémoire, sans accès disque"""
+    return _entries.get(url)
+
+def load(url: str) -> Optional[Tuple[CacheEntry, Any]]:
+    """Lit l'entrée et son corps sur disque (bloquant : à appeler hors de la boucle)"""
+    try:
+        with open(_path(url), encoding='utf-8') as f:
+            data = json.load(f)
+        body = data.pop('body')
+        entry = _entries.get(url) or CacheEntry(**data)
+    except (OSError, ValueError, TypeError, KeyError):
+        _entries.pop(url, None)
+        return None
+    _entries[url] = entry
+    return entry, body
+
+def save(entry: CacheEntry, body: Any):
+    """Écrit le corps et les métadonnées (bloquant : à appeler hors de la boucle)"""
+    entry.digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Écriture atomique via un fichier temporaire propre à cet appel
+    with tempfile.NamedTemporaryFile('w', dir=CACHE_DIR, suffix='.tmp', encoding='utf-8', delete=False) as f:
+        json.dump({**asdict(entry), 'body': body}, f)
+    try:
+        os.replace(f.name, _path(entry.url))
+    except OSError:
+        os.unlink(f.name)
+        raise
+    _entries[entry.url] = entry
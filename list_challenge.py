@@ -1,80 +1,142 @@
 import os
 import sys
 import json
-import requests
+import asyncio
+import logging
+import htb_client
+import log
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Tuple, Union
+from models import Challenge, Fortress, Machine
 from rich.console import Console
 from rich.table import Table
-import time
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 HTB_API_TOKEN = os.environ.get('HTB_API_TOKEN')
 if not HTB_API_TOKEN:
-    print("[-] Erreur: La variable d'environnement HTB_API_TOKEN n'est pas définie")
+    logger.error("Erreur: La variable d'environnement HTB_API_TOKEN n'est pas définie")
     sys.exit(1)
 
-# Headers pour les requêtes API
-headers = {
-    "Host": "labs.hackthebox.com",
-    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0",
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Language": "fr,fr-FR;q=0.8,en-US;q=0.5,en;q=0.3",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Authorization": f"Bearer {HTB_API_TOKEN}",
-    "Origin": "https://app.hackthebox.com",
-    "Connection": "keep-alive",
-    "Referer": "https://app.hackthebox.com/",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "same-site"
-}
-
-@dataclass
-class HTBContent:
-    name: str
-    difficulty: str
-    points: int
-    status: str
-    rating: float = 0.0
-    solves: int = 0
-    release_date: Optional[str] = None
-
 class HTBDataFetcher:
     def __init__(self):
         self.console = Console()
-        self.base_url = "https://www.hackthebox.com/api/v4"
+        self.base_url = htb_client.WWW_API
 
     async def fetch_data(self, endpoint: str) -> List[Dict]:
         url = f"{self.base_url}/{endpoint}"
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Debug: afficher la structure des données et l'URL
-            print(f"\n[DEBUG] Requête vers: {url}")
-            print(f"Status code: {response.status_code}")
-            print(f"Type: {type(data)}")
+        # Le cache HTTP ne garde en mémoire que les métadonnées : une page déjà
+        # consommée par iter_content n'est plus référencée
+        data = await htb_client.get_json_cached(url, htb_client.CATALOGUE_TTL)
+        if data is None:
+            logger.error("Erreur lors de la requête vers %s", endpoint)
+            return []
+
+        # Structure des données, seulement en DEBUG pour ne pas sérialiser les réponses inutilement
+        if logger.isEnabledFor(logging.DEBUG):
             if isinstance(data, dict):
-                print("Clés:", list(data.keys()))
-                # Les challenges sont sous la clé 'challenges'
-                if 'challenges' in data:
-                    return data['challenges']
-                # Pour les machines paginées
-                elif 'data' in data and isinstance(data['data'], list):
-                    return data
-                # Pour les forteresses
-                return data
+                logger.debug("Requête vers %s: %s, clés %s", url, type(data).__name__, list(data.keys()))
+            elif data and isinstance(data, list):
+                logger.debug("Requête vers %s: %s, premier élément %s", url, type(data).__name__, json.dumps(data[0]))
+        # Les challenges sont sous la clé 'challenges'
+        if isinstance(data, dict) and 'challenges' in data:
+            return data['challenges']
+        # Machines paginées et forteresses sont retournées telles quelles
+        return data
+
+    @staticmethod
+    def parse_challenges(challenges_data) -> List[Challenge]:
+        return [Challenge.from_api(c) for c in challenges_data if isinstance(c, dict)]
+
+    @staticmethod
+    def parse_machines(machines_data: Dict) -> List[Machine]:
+        machines = []
+        for m in machines_data['data']:
+            if isinstance(m, dict):
+                try:
+                    machines.append(Machine.from_api(m))
+                except (ValueError, TypeError) as e:
+                    logger.error("Erreur lors du traitement de la machine %s: %s", m.get('name', 'Inconnu'), e)
+                    continue
+        return machines
+
+    @staticmethod
+    def parse_fortresses(fortresses_data) -> List[Fortress]:
+        if fortresses_data and isinstance(fortresses_data, dict) and 'data' in fortresses_data:
+            return [Fortress.from_api(f) for f in fortresses_data['data'].values() if isinstance(f, dict)]
+        return []
+
+    async def iter_machine_pages(self) -> AsyncIterator[Dict]:
+        """Génère les pages de machines à mesure qu'elles arrivent, la première donnant le nombre de pages"""
+        endpoint = "machine/paginated?retired=0&page={}"
+        machines_data = await self.fetch_data(endpoint.format(1))
+        if not isinstance(machines_data, dict) or 'data' not in machines_data:
+            return
+        yield machines_data
+        last_page = machines_data.get('meta', {}).get('last_page')
+        if isinstance(last_page, int):
+            # Les pages restantes sont récupérées en parallèle
+            async for machines_data in htb_client.iter_limited(
+                    lambda page: self.fetch_data(endpoint.format(page)), range(2, last_page + 1)):
+                if isinstance(machines_data, dict) and 'data' in machines_data:
+                    yield machines_data
+            return
+        # Sans métadonnées de pagination, on suit les liens page par page
+        page = 1
+        while machines_data.get('links', {}).get('next'):
+            page += 1
+            machines_data = await self.fetch_data(endpoint.format(page))
+            if not isinstance(machines_data, dict) or 'data' not in machines_data:
+                break
+            yield machines_data
+
+    async def iter_content(self) -> AsyncIterator[Tuple[str, List[Union[Challenge, Machine, Fortress]]]]:
+        """Génère des lots ('challenges' | 'machines' | 'fortresses', enregistrements normalisés)
+
+        Challenges, pages de machines et forteresses sont récupérés en parallèle
+        et chaque lot est transmis dès son arrivée, sans attendre la fin du parcours.
+        """
+        # File bornée : un consommateur lent ralentit les producteurs au lieu
+        # de laisser s'accumuler les pages déjà analysées
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        async def fetch_challenges():
+            await queue.put(('challenges', self.parse_challenges(await self.fetch_data("challenge/list"))))
+
+        async def fetch_machines():
+            async for machines_data in self.iter_machine_pages():
+                await queue.put(('machines', self.parse_machines(machines_data)))
+
+        async def fetch_fortresses():
+            await queue.put(('fortresses', self.parse_fortresses(await self.fetch_data("fortresses"))))
+
+        async def produce(fetch):
+            # Chaque producteur signale sa fin (ou son exception) dans la file elle-même
+            try:
+                await fetch()
+            except Exception as e:
+                await queue.put(e)
             else:
-                if data and isinstance(data, list):
-                    print("Premier élément:", json.dumps(data[0], indent=2))
-                return data
-        except requests.exceptions.RequestException as e:
-            self.console.print(f"[red][-] Erreur lors de la requête vers {endpoint}: {e}[/red]")
-            return []
+                await queue.put(None)
+
+        producers = [asyncio.ensure_future(produce(fetch))
+                     for fetch in (fetch_challenges, fetch_machines, fetch_fortresses)]
+        try:
+            remaining = len(producers)
+            while remaining:
+                batch = await queue.get()
+                if batch is None:
+                    remaining -= 1
+                elif isinstance(batch, Exception):
+                    raise batch
+                else:
+                    yield batch
+        finally:
+            # Arrêt anticipé ou échec d'un producteur : les autres ne doivent pas continuer seuls
+            for producer in producers:
+                producer.cancel()
 
     def format_date(self, date_str: str) -> str:
         if not date_str:
@@ -85,7 +147,7 @@ class HTBDataFetcher:
         except ValueError:
             return "N/A"
 
-    def create_table(self, title: str, items: List[HTBContent]) -> Table:
+    def create_table(self, title: str, items: List[Union[Challenge, Machine, Fortress]]) -> Table:
         table = Table(title=title, show_header=True, header_style="bold magenta")
         table.add_column("Nom", style="cyan")
         table.add_column("Difficulté", style="green")
@@ -98,7 +160,7 @@ class HTBDataFetcher:
         for item in sorted(items, key=lambda x: (-x.rating, x.name)):
             table.add_row(
                 item.name,
-                item.difficulty,
+                item.difficulty_text,
                 str(item.points),
                 item.status,
                 f"{item.rating:.1f}/5.0" if item.rating else "N/A",
@@ -109,119 +171,30 @@ class HTBDataFetcher:
         return table
 
     async def fetch_and_display_all(self):
-        # Récupération des challenges
-        self.console.print("\n[bold cyan]Récupération des challenges...[/bold cyan]")
-        challenges_data = await self.fetch_data("challenge/list")
+        self.console.print("\n[bold cyan]Récupération des challenges, machines et forteresses...[/bold cyan]")
         challenges = []
-        
-        for c in challenges_data:
-            if isinstance(c, dict):
-                # Conversion des points en entier avec gestion des strings
-                points_str = str(c.get('points', '0'))
-                try:
-                    points = int(points_str)
-                except ValueError:
-                    points = 0
-                    
-                challenges.append(HTBContent(
-                    name=c.get('name', 'Inconnu'),
-                    difficulty=f"{c.get('difficulty', 'Inconnu')} ({c.get('avg_difficulty', 0)}/100)",
-                    points=points,
-                    status='Retraité' if c.get('retired', False) else 'Actif',
-                    rating=float(c.get('rating', 0)),
-                    solves=c.get('solves', 0),
-                    release_date=c.get('release_date')
-                ))
-        
+        machines = []
+        fortresses = []
+
+        async for kind, records in self.iter_content():
+            if kind == 'challenges':
+                challenges.extend(records)
+            elif kind == 'machines':
+                machines.extend(records)
+                logger.info("Page traitée, %d machines récupérées...", len(machines))
+            else:
+                fortresses.extend(records)
+
         if challenges:
             self.console.print(self.create_table("Challenges HTB", challenges))
         else:
             self.console.print("[red]Aucun challenge trouvé ou format de données incorrect[/red]")
 
-        # Attendre avant de passer aux machines
-        time.sleep(2)
-
-        # Récupération des machines
-        self.console.print("\n[bold cyan]Récupération des machines...[/bold cyan]")
-        machines = []
-        page = 1
-        
-        while True:
-            machines_data = await self.fetch_data(f"machine/paginated?retired=0&page={page}")
-            
-            # Vérifier la structure des données
-            if not isinstance(machines_data, dict) or 'data' not in machines_data:
-                print(f"[red]Structure de données invalide pour la page {page}[/red]")
-                break
-            
-            # Traitement des machines de la page courante
-            for m in machines_data['data']:
-                if isinstance(m, dict):
-                    try:
-                        # Créer un tag pour les machines spéciales
-                        tags = []
-                        if m.get('is_competitive'):
-                            tags.append('COMPETITIVE')
-                        if m.get('labels'):
-                            tags.extend(label['name'] for label in m['labels'])
-                        status_parts = [m.get('os', 'Inconnu')]
-                        if tags:
-                            status_parts.append(f"[{', '.join(tags)}]")
-                        status_parts.append('Gratuit' if m.get('free', False) else 'VIP')
-                        
-                        machines.append(HTBContent(
-                            name=m.get('name', 'Inconnu'),
-                            difficulty=f"{m.get('difficultyText', 'Inconnu')} ({m.get('difficulty', 0)}/100)",
-                            points=int(m.get('points', 0)),
-                            status=' - '.join(status_parts),
-                            rating=float(m.get('star', 0)),
-                            solves=m.get('user_owns_count', 0),
-                            release_date=m.get('release')
-                        ))
-                    except (ValueError, TypeError) as e:
-                        print(f"[red]Erreur lors du traitement de la machine {m.get('name', 'Inconnu')}: {e}[/red]")
-                        continue
-            
-            print(f"[cyan]Page {page} traitée, {len(machines)} machines récupérées...[/cyan]")
-            
-            # Vérifier s'il y a une page suivante
-            if not machines_data.get('links', {}).get('next'):
-                break
-                
-            # Attendre un peu entre les pages
-            time.sleep(1)
-            page += 1
-            
         if machines:
             self.console.print(self.create_table("Machines HTB", machines))
         else:
             self.console.print("[red]Aucune machine trouvée ou format de données incorrect[/red]")
 
-        # Attendre avant de passer aux forteresses
-        time.sleep(2)
-
-        # Récupération des forteresses
-        self.console.print("\n[bold cyan]Récupération des forteresses...[/bold cyan]")
-        fortresses = []
-        
-        try:
-            fortresses_data = await self.fetch_data("fortresses")
-            
-            if fortresses_data and isinstance(fortresses_data, dict) and 'data' in fortresses_data:
-                for f in fortresses_data['data'].values():
-                    if isinstance(f, dict):
-                        fortresses.append(HTBContent(
-                            name=f.get('name', 'Inconnu'),
-                            difficulty=f"Drapeaux: {f.get('number_of_flags', 0)}",
-                            points=f.get('id', 0),
-                            status='Nouveau' if f.get('new', False) else 'Standard',
-                            rating=0.0,
-                            solves=0,
-                            release_date=None
-                        ))
-        except Exception as e:
-            self.console.print(f"[red]Erreur lors de la récupération des forteresses: {e}[/red]")
-        
         if fortresses:
             self.console.print(self.create_table("Forteresses HTB", fortresses))
         else:
@@ -234,60 +207,18 @@ class HTBDataFetcher:
             'machines': [],
             'fortresses': []
         }
-        
-        # Récupération des challenges
-        challenges_data = await self.fetch_data("challenge/list")
-        for c in challenges_data:
-            if isinstance(c, dict):
-                all_content['challenges'].append({
-                    'id': str(c.get('id')),
-                    'name': c.get('name', 'Inconnu'),
-                    'difficulty': f"{c.get('difficulty', 'Inconnu')} ({c.get('avg_difficulty', 0)}/100)",
-                    'points': int(str(c.get('points', '0')).strip() or '0'),
-                    'status': 'Retraité' if c.get('retired', False) else 'Actif'
-                })
-        
-        # Récupération des machines
-        page = 1
-        while True:
-            machines_data = await self.fetch_data(f"machine/paginated?retired=0&page={page}")
-            if not isinstance(machines_data, dict) or 'data' not in machines_data:
-                break
-                
-            for m in machines_data['data']:
-                if isinstance(m, dict):
-                    try:
-                        all_content['machines'].append({
-                            'id': str(m.get('id')),
-                            'name': m.get('name', 'Inconnu'),
-                            'difficulty': f"{m.get('difficultyText', 'Inconnu')} ({m.get('difficulty', 0)}/100)",
-                            'points': int(m.get('points', 0)),
-                            'os': m.get('os', 'Inconnu'),
-                            'free': m.get('free', False)
-                        })
-                    except (ValueError, TypeError):
-                        continue
-                        
-            if not machines_data.get('links', {}).get('next'):
-                break
-            page += 1
-            time.sleep(1)
-        
-        # Récupération des forteresses
-        fortresses_data = await self.fetch_data("fortresses")
-        if fortresses_data and isinstance(fortresses_data, dict) and 'data' in fortresses_data:
-            for f in fortresses_data['data'].values():
-                if isinstance(f, dict):
-                    all_content['fortresses'].append({
-                        'id': str(f.get('id')),
-                        'name': f.get('name', 'Inconnu'),
-                        'flags': f.get('number_of_flags', 0),
-                        'new': f.get('new', False)
-                    })
-        
+        async for kind, records in self.iter_content():
+            all_content[kind].extend(records)
         return all_content
 
 if __name__ == "__main__":
-    import asyncio
-    fetcher = HTBDataFetcher()
-    asyncio.run(fetcher.fetch_and_display_all())
+    log.setup()
+
+    async def main():
+        fetcher = HTBDataFetcher()
+        try:
+            await fetcher.fetch_and_display_all()
+        finally:
+            await htb_client.close()
+
+    asyncio.run(main())
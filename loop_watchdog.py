@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import logging
+import asyncio
+import threading
+import traceback
+from typing import Optional
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Surveillance de la boucle asyncio : une tâche mesure le retard de ses réveils
+# (lag) et un thread relève la pile de la boucle lorsqu'elle reste bloquée.
+CHECK_INTERVAL = 0.5
+# Durée de blocage (en secondes) au-delà de laquelle la pile est journalisée
+BLOCK_THRESHOLD = float(os.environ.get('LOOP_BLOCK_THRESHOLD', '1'))
+
+class LoopWatchdog:
+    def __init__(self, interval: float = CHECK_INTERVAL, threshold: float = BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            metrics.loop_lag.observe(lag)
+            metrics.loop_lag_current.set(lag)
+
+    def _watch(self):
+        # Thread séparé : il tourne même quand la boucle est bloquée
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            # Une seule trace par blocage, prise pendant qu'il est en cours
+            reported = heartbeat
+            metrics.loop_blocks.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)).rstrip() if frame is not None else '(pile indisponible)'
+            logger.warning("Boucle asyncio bloquée depuis %.2fs, pile en cours :\n%s", blocked, stack,
+                           extra={'blocked_seconds': round(blocked, 3)})
+
+watchdog = LoopWatchdog()
@@ -1,18 +1,32 @@
 import os
-import requests
+import json
+import signal
+import logging
+import hashlib
 import discord
 import asyncio
-import aiohttp
 import db
+import log
+import async_db
+import htb_client
+import metrics
+import profiling
+from roster import roster
+from announcer import Announcer
+from loop_watchdog import watchdog
+from scheduler import scheduler
 from discord.ext import tasks
 from pathlib import Path
+from typing import List
+from models import Activity, Challenge, CompletedContent
 from datetime import time, timezone, datetime
 
 time_21   = time(hour=21, tzinfo=timezone.utc)
 time_21_1 = time(hour=21, minute=1, tzinfo=timezone.utc)
 
+logger = logging.getLogger('main')
+
 # Configuration des clients et constantes
-HTB_API_TOKEN = os.environ.get('HTB_API_TOKEN')
 DISCORD_TOKEN = os.environ.get('DISCORD_TOKEN')
 DISCORD_CHANNEL_ID = int(os.environ.get('DISCORD_CHANNEL_ID'))
 DISCORD_TODO_CHANNEL_ID = int(os.environ.get('DISCORD_TODO_CHANNEL_ID'))
@@ -20,211 +34,222 @@ DISCORD_TODO_CHANNEL_ID = int(os.environ.get('DISCORD_TODO_CHANNEL_ID'))
 # Configuration des chemins
 DATA_DIR = Path("data")
 
-# Id des messages
-monitor_messages = {
-    "challenges": None,
-    "machines": None,
-    "forteresses": None
-}
+# Catégories de la todo list, un message Discord par catégorie
+# (leurs id sont conservés en base dans monitor_messages)
+TODO_CATEGORIES = ("challenges", "machines", "forteresses")
+
+# Durée de validité des catégories de challenges en cache (en secondes)
+CATEGORY_TTL = 7 * 24 * 3600
+# Dates de rafraîchissement étalées sur cette durée : après le remplissage initial,
+# le catalogue expire par morceaux au lieu de tout redemander le même jour
+CATEGORY_TTL_JITTER = CATEGORY_TTL // 2
+
+class TrackerClient(discord.Client):
+    async def close(self):
+        """Ferme aussi la session HTTP partagée et l'endpoint /metrics, encore dans la boucle"""
+        try:
+            await super().close()
+        finally:
+            await htb_client.close()
+            await metrics.stop_server()
 
 # Configuration du client Discord
-client = discord.Client(intents=discord.Intents.default())
-
-headers = {
-    "Host": "labs.hackthebox.com",
-    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:139.0) Gecko/20100101 Firefox/139.0",
-    "Accept": "application/json, text/plain, */*",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Authorization": f"Bearer {HTB_API_TOKEN}",
-    "Origin": "https://app.hackthebox.com",
-    "Connection": "keep-alive",
-    "Referer": "https://app.hackthebox.com/",
-    "Sec-Fetch-Dest": "empty",
-    "Sec-Fetch-Mode": "cors",
-    "Sec-Fetch-Site": "same-site"
-}
-
-async def get_latest_activity(member_id):
-    activity_url = f"https://labs.hackthebox.com/api/v4/user/profile/activity/{member_id}"
-    try:
-        response = requests.get(activity_url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            activities = response.json().get('profile', {}).get('activity', [])
-            if activities:
-                # For machines, check if activity contains flag_type
-                activity = activities[0]
-                if activity.get('object_type') == 'machine':
-                    flag_type = activity.get('type', None)
-                    if flag_type in ('user', 'root'):
-                        db.add_machine_flag(str(member_id), str(activity.get('id')), flag_type)
-                return activity
-        else:
-            print(f"[-] Erreur lors de la requête d'activité pour l'ID {member_id}: {response.status_code}")
-    except requests.exceptions.Timeout:
-        print(f"[-] Timeout pour la requête d'activité de l'ID {member_id}")
-    except Exception as e:
-        print(f"[-] Erreur inattendue pour l'ID {member_id}: {str(e)}")
-    return None
+client = TrackerClient(intents=discord.Intents.default())
+announcer = Announcer(client, DISCORD_CHANNEL_ID)
+
+async def get_new_activities(member_id, cursor):
+    """Retourne les activités postérieures au curseur, de la plus ancienne à la plus récente"""
+    activity_url = f"{htb_client.LABS_API}/user/profile/activity/{member_id}"
+    data = await htb_client.get_json(activity_url)
+    if data is None:
+        logger.error("Erreur lors de la requête d'activité pour l'ID %s", member_id)
+        return None
+    activities = data.get('profile', {}).get('activity', [])
+    if cursor is None:
+        # Nouveau membre : tout l'historique est enregistré, seule la dernière activité est traitée
+        history = [Activity.from_api(act) for act in activities]
+        await async_db.bulk_add_activities(str(member_id), history)
+        return history[:1]
+    new_activities = []
+    for act in activities:
+        activity = Activity.from_api(act)
+        if activity.key == cursor:
+            break
+        new_activities.append(activity)
+    if new_activities:
+        await async_db.bulk_add_activities(str(member_id), new_activities)
+    new_activities.reverse()
+    return new_activities
 
 async def fetch_htb_content():
-    print("[*] Récupération des contenus HTB...")
+    logger.info("Récupération des contenus HTB...")
     challenges = []
     machines = []
     fortresses = []
 
-    async def fetch_with_retry(url, max_retries=3, delay=2):
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers, timeout=10) as resp:
-                        if resp.status == 200:
-                            return await resp.json()
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    print(f"[!] Tentative {attempt + 1} échouée pour {url}: {e}")
-                await asyncio.sleep(delay * (attempt + 1))
-        return None
-
-    # Récupération des challenges
-    challenges_data = await fetch_with_retry("https://www.hackthebox.com/api/v4/challenge/list")
+    # Récupération des challenges, machines et forteresses en parallèle
+    challenges_data, machines_data, fortresses_data = await asyncio.gather(
+        htb_client.get_json_cached(f"{htb_client.WWW_API}/challenge/list", htb_client.CATALOGUE_TTL, retries=3),
+        htb_client.get_json_cached(f"{htb_client.WWW_API}/machine/paginated?retired=0", htb_client.CATALOGUE_TTL, retries=3),
+        htb_client.get_json_cached(f"{htb_client.WWW_API}/fortresses", htb_client.CATALOGUE_TTL, retries=3)
+    )
     if challenges_data:
         challenges = challenges_data
-        print(f"[+] {len(challenges)} challenges récupérés")
+        logger.info("%d challenges récupérés", len(challenges))
 
-    # Récupération des machines
-    machines_data = await fetch_with_retry("https://www.hackthebox.com/api/v4/machine/paginated?retired=0")
     if machines_data and 'data' in machines_data:
         machines = machines_data['data']
-        print(f"[+] {len(machines)} machines récupérées")
+        logger.info("%d machines récupérées", len(machines))
 
-    # Récupération des forteresses
-    fortresses_data = await fetch_with_retry("https://www.hackthebox.com/api/v4/fortresses")
     if fortresses_data:
         fortresses = fortresses_data
-        print(f"[+] {len(fortresses)} forteresses récupérées")
+        logger.info("%d forteresses récupérées", len(fortresses))
 
 @client.event
 async def on_ready():
-    print(f"[+] Connecté en tant que {client.user.name}")
+    logger.info("Connecté en tant que %s", client.user.name)
     
     # Création du dossier data si nécessaire
     if not DATA_DIR.exists():
         DATA_DIR.mkdir(parents=True)
     
-    # Démarrage des tâches périodiques
+    # Démarrage de la file d'envoi des annonces puis des tâches périodiques
+    watchdog.start()
+    await metrics.start_server()
+    await announcer.start()
+    scheduler.seed(await async_db.get_last_activity_dates())
     update_htb_content.start()
     check_member_progress.start()
 
     tracker = HTBUniversityTracker()
     await tracker.update_university_progress()
 
-    print("[+] Bot prêt !")
+    logger.info("Bot prêt !")
     
     if not daily_update.is_running():
         daily_update.start()
 
-@tasks.loop(minutes=5)
+@tasks.loop(seconds=scheduler.tick)
+@profiling.profiled('check_member_progress')
 async def check_member_progress():
     try:
-        print("\n[+] Démarrage d'une nouvelle vérification...")
-        url = "https://labs.hackthebox.com/api/v4/university/members/518"
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print(f"[-] Erreur lors de la requête API: {response.text}")
-            return
-        data = response.json()
-        print(f"[+] Nombre de membres trouvés: {len(data)}")
-        channel = client.get_channel(DISCORD_CHANNEL_ID)
-        if not channel:
-            print("[-] Impossible de trouver le channel Discord")
-            return
-        print(f"[+] Channel Discord trouvé: {channel.name}")
-        # Récupérer la todo list depuis la base
-        todo_rows = db.get_todo()
-        todo_challenges = set(htb_id for t, htb_id, _ in todo_rows if t == 'challenge')
-        # For machines, track user and root flags separately
-        todo_machine_user = set(f"{htb_id}:user" for t, htb_id, _ in todo_rows if t == 'machine_user')
-        todo_machine_root = set(f"{htb_id}:root" for t, htb_id, _ in todo_rows if t == 'machine_root')
-        todo_fortresses = set(htb_id for t, htb_id, _ in todo_rows if t == 'fortress')
-        for member in data:
-            member_id = member['id']
-            # Attente entre chaque requête pour éviter de surcharger l'API
-            await asyncio.sleep(0.5)
-            current_activity = await get_latest_activity(member_id)
-            await asyncio.sleep(0.5)
-            if not current_activity:
-                print(f"[-] Pas d'activité trouvée pour {member['name']}")
-                continue
-            name = current_activity.get('name', 'Inconnu')
-            points = current_activity.get('points', 0)
-            object_type = current_activity.get('object_type', '')
-            activity_id = str(current_activity.get('id', '0'))
-            flag_type = current_activity.get('type', None)
-            thumbnail = member.get('avatar')
-            if thumbnail:
-                if not thumbnail.startswith('http'):
-                    thumbnail = f"https://labs.hackthebox.com/{thumbnail.lstrip('/')}"
-            else:
-                thumbnail = 'https://avatars.githubusercontent.com/u/128290827?s=200&v=4'
-            # Vérifier si l'activité est dans la todo list
-            is_todo = False
-            # --- Machines: user and root flags are separate ---
-            if object_type == 'machine' and flag_type in ('user', 'root'):
-                todo_key = f"{activity_id}:{flag_type}"
-                if (flag_type == 'user' and todo_key in todo_machine_user) or (flag_type == 'root' and todo_key in todo_machine_root):
-                    is_todo = True
-            elif object_type == 'challenge' and activity_id in todo_challenges:
-                is_todo = True
-            elif object_type == 'fortress' and activity_id in todo_fortresses:
-                is_todo = True
-            if not is_todo:
-                print(f"[!] Activité {object_type} {activity_id} de {member['name']} ignorée (pas dans la todo)")
-                continue
-
-            # Détermination du type et de la catégorie
-            if object_type == 'machine':
-                activity_type = 'Machine'
-                category = current_activity.get('type', '').upper()
-            elif object_type == 'challenge':
-                activity_type = 'Challenge'
-                category = current_activity.get('challenge_category', 'Unknown')
-            else:
-                activity_type = object_type
-                category = current_activity.get('type', 'Unknown')
-            if str(points) == '0':
-                name = f"{name} Retiré"
-            embed = discord.Embed(
-                title=f":drop_of_blood: First blood de {name} !",
-                description=(
-                    f"**Pseudo** : `{member['name']}`\n"
-                    f"**Type** : `{activity_type}`\n"
-                    f"**Catégorie** : `{category}`\n"
-                    f"**Points** : `+{points}`\n"
-                    f"**Rank** : `{member['rank_text']}`"
-                ),
-                color=0xFF0000,
-            )
-            embed.set_footer(text="GCC University First Blood Tracker")
-            embed.set_thumbnail(url=thumbnail)
-            await channel.send(embed=embed)
-            # Remove only the completed flag from todo for machines
-            if object_type == 'machine' and flag_type in ('user', 'root'):
-                db.remove_todo(f"machine_{flag_type}", activity_id)
-            elif object_type == 'challenge':
-                db.remove_todo(object_type, activity_id)
-            elif object_type == 'fortress':
-                db.remove_todo(object_type, activity_id)
-            tracker = HTBUniversityTracker()
-            await tracker.update_university_progress()
-        print("=" * 50)
-    except Exception as e:
-        print(f"[-] Une erreur est survenue: {e}")
-        print(f"[-] Détails de l'erreur:", str(e.__class__.__name__))
+        with metrics.track_loop('check_member_progress'):
+            profiling.mark('membres')
+            members = await roster.get_members()
+            if members is None:
+                logger.error("Erreur lors de la requête API des membres")
+                return
+            # Seuls les membres dont le prochain sondage est échu sont interrogés
+            due_ids = set(scheduler.due(str(member['id']) for member in members))
+            data = [member for member in members if str(member['id']) in due_ids]
+            if not data:
+                return
+            logger.info("Vérification de %d membres sur %d", len(data), len(members))
+            profiling.mark('activité des membres')
+            cursors = await async_db.get_activity_cursors()
+            results = await htb_client.gather_limited(
+                lambda member: get_new_activities(member['id'], cursors.get(str(member['id']))), data)
+            for member, member_activities in zip(data, results):
+                scheduler.record(str(member['id']), member_activities is not None,
+                                 member_activities[-1].date if member_activities else None)
+            # Toutes les nouvelles activités, dans l'ordre chronologique, pour attribuer
+            # le first blood au premier membre même si plusieurs ont résolu entre deux sondages
+            new_activities = []
+            new_cursors = []
+            for member, member_activities in zip(data, results):
+                if not member_activities:
+                    continue
+                new_activities.extend((member, activity) for activity in member_activities)
+                new_cursors.append((str(member['id']), *member_activities[-1].key))
+            new_activities.sort(key=lambda item: item[1].date)
+            if new_activities:
+                logger.info("%d nouvelles activités", len(new_activities))
+            profiling.mark('first bloods')
+            updated_categories = set()
+            for member, current_activity in new_activities:
+                name = current_activity.name
+                points = current_activity.points
+                object_type = current_activity.object_type
+                activity_id = current_activity.id
+                flag_type = current_activity.type
+                thumbnail = member.get('avatar')
+                if thumbnail:
+                    if not thumbnail.startswith('http'):
+                        thumbnail = f"https://labs.hackthebox.com/{thumbnail.lstrip('/')}"
+                else:
+                    thumbnail = 'https://avatars.githubusercontent.com/u/128290827?s=200&v=4'
+                # Vérifier si l'activité est dans la todo list (recherche par clé primaire)
+                # --- Machines: user and root flags are separate ---
+                if object_type == 'machine' and flag_type in ('user', 'root'):
+                    todo_type = f"machine_{flag_type}"
+                elif object_type in ('challenge', 'fortress'):
+                    todo_type = object_type
+                else:
+                    todo_type = None
+                if todo_type is None or not await async_db.is_todo(todo_type, activity_id):
+                    logger.debug("Activité %s %s de %s ignorée (pas dans la todo)", object_type, activity_id, member['name'])
+                    continue
+                # La todo n'est reconstruite qu'une fois par jour : on vérifie aussi
+                # qu'aucun autre membre n'a obtenu ce flag avant lui
+                if await async_db.is_solved(object_type, activity_id, flag_type,
+                                            before=current_activity.date, exclude_user=str(member['id'])):
+                    logger.debug("Activité %s %s de %s ignorée (déjà obtenue par un autre membre)",
+                                 object_type, activity_id, member['name'])
+                    continue
+
+                # Détermination du type et de la catégorie
+                if object_type == 'machine':
+                    activity_type = 'Machine'
+                    category = current_activity.type.upper()
+                elif object_type == 'challenge':
+                    activity_type = 'Challenge'
+                    category = current_activity.challenge_category
+                else:
+                    activity_type = object_type
+                    category = current_activity.type or 'Unknown'
+                if points == 0:
+                    name = f"{name} Retiré"
+                embed = discord.Embed(
+                    title=f":drop_of_blood: First blood de {name} !",
+                    description=(
+                        f"**Pseudo** : `{member['name']}`\n"
+                        f"**Type** : `{activity_type}`\n"
+                        f"**Catégorie** : `{category}`\n"
+                        f"**Points** : `+{points}`\n"
+                        f"**Rank** : `{member['rank_text']}`"
+                    ),
+                    color=0xFF0000,
+                )
+                embed.set_footer(text="GCC University First Blood Tracker")
+                embed.set_thumbnail(url=thumbnail)
+                await announcer.announce(embed)
+                # Remove only the completed flag from todo for machines
+                await async_db.remove_todo(todo_type, activity_id)
+                if object_type == 'machine':
+                    updated_categories.add('machines')
+                elif object_type == 'challenge':
+                    updated_categories.add('challenges')
+                else:
+                    updated_categories.add('forteresses')
+            await async_db.bulk_set_activity_cursors(new_cursors)
+            profiling.mark('publication discord')
+            # Seuls les messages todo concernés sont mis à jour, la réconciliation
+            # complète reste à la charge de la tâche quotidienne
+            if updated_categories and client.is_ready():
+                await HTBUniversityTracker().send_todo_to_discord(updated_categories)
+    except Exception:
+        logger.exception("Une erreur est survenue pendant la vérification des membres")
 
 @tasks.loop(time=time_21)
 async def update_htb_content():
-    await fetch_htb_content()
+    with metrics.track_loop('update_htb_content'):
+        await fetch_htb_content()
+
+def embed_hash(embed):
+    """Empreinte du contenu d'un embed, sans son horodatage"""
+    content = embed.to_dict() if embed else {}
+    content.pop('timestamp', None)
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
 
 class HTBUniversityTracker:
     def __init__(self):
@@ -232,143 +257,117 @@ class HTBUniversityTracker:
         self.university_users = []
 
     async def load_university_users(self):
-        print("[*] Récupération des membres de l'université...")
-        url = "https://labs.hackthebox.com/api/v4/university/members/518"
+        logger.info("Récupération des membres de l'université...")
         try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = await roster.get_members(retries=3)
+            if data is None:
+                raise RuntimeError(f"réponse invalide pour {roster.url}")
             self.university_users = [{
                 'htb_id': str(member['id']),
                 'name': member['name']
             } for member in data]
-            for member in self.university_users:
-                db.add_or_update_user(member['htb_id'], member['name'])
-            print(f"[+] {len(self.university_users)} membres trouvés et enregistrés en base")
+            logger.info("%d membres trouvés", len(self.university_users))
         except Exception as e:
-            print(f"[-] Erreur lors de la récupération des membres: {e}")
+            logger.error("Erreur lors de la récupération des membres: %s", e)
             self.university_users = []
 
-    async def get_user_completed_content(self, user_id: str) -> dict:
-        await asyncio.sleep(0.4)
-        url = f"https://labs.hackthebox.com/api/v4/user/profile/activity/{user_id}"
-        completed = {
-            'challenges': set(),
-            'machines': set(),
-            'fortresses': set()
-        }
+    async def get_user_activities(self, user_id: str) -> List[Activity]:
+        url = f"{htb_client.LABS_API}/user/profile/activity/{user_id}"
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(url, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        activities = data.get('profile', {}).get('activity', [])
-                        for act in activities:
-                            if act.get('object_type') == 'challenge':
-                                completed['challenges'].add(str(act.get('id')))
-                            elif act.get('object_type') == 'machine':
-                                completed['machines'].add(str(act.get('id')))
-                            elif act.get('object_type') == 'fortress':
-                                completed['fortresses'].add(str(act.get('id')))
-            return completed
+            data = await htb_client.get_json(url)
+            if data is None:
+                return []
+            return [Activity.from_api(act) for act in data.get('profile', {}).get('activity', [])]
         except Exception as e:
-            print(f"[-] Erreur lors de la récupération des défis pour l'utilisateur {user_id}: {e}")
-            return {'challenges': set(), 'machines': set(), 'fortresses': set()}
+            logger.error("Erreur lors de la récupération des défis pour l'utilisateur %s: %s", user_id, e)
+            return []
 
+    @profiling.profiled('update_university_progress')
     async def update_university_progress(self):
         from list_challenge import HTBDataFetcher
-        print("[*] Mise à jour des défis de l'université...")
+        logger.info("Mise à jour des défis de l'université...")
         self.htb_fetcher = HTBDataFetcher()
+        profiling.mark('membres')
         await self.load_university_users()
-        all_content = await self.htb_fetcher.get_all_content()
         # --- Récupérer la catégorie exacte de chaque challenge via l'API ---
-        async def fetch_challenge_category(session, challenge_id):
-            url = f"https://www.hackthebox.com/api/v4/challenge/info/{challenge_id}"
-            try:
-                await asyncio.sleep(0.5)
-                async with session.get(url, headers=headers, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        if 'challenge' in data and 'category_name' in data['challenge']:
-                            return data['challenge']['category_name']
-                        else:
-                            print(f"[!] Catégorie absente pour challenge {challenge_id}. Réponse brute: {data}")
-                    else:
-                        print(f"[!] Statut HTTP {resp.status} pour challenge {challenge_id}")
-            except Exception as e:
-                print(f"[!] Erreur récupération catégorie pour challenge {challenge_id}: {e}")
+        async def fetch_challenge_category(challenge_id):
+            url = f"{htb_client.WWW_API}/challenge/info/{challenge_id}"
+            data = await htb_client.get_json(url)
+            if data is None:
+                logger.warning("Erreur récupération catégorie pour challenge %s", challenge_id)
+            elif 'challenge' in data and 'category_name' in data['challenge']:
+                return data['challenge']['category_name']
+            else:
+                logger.warning("Catégorie absente pour challenge %s", challenge_id)
+                logger.debug("Réponse brute pour le challenge %s: %s", challenge_id, data)
             return ''
-        # Enregistre tous les challenges, machines, forteresses en base
-        async with aiohttp.ClientSession() as session:
-            for c in all_content['challenges']:
-                # Récupérer la catégorie exacte
-                category = await fetch_challenge_category(session, c['id'])
-                db.add_or_update_challenge(str(c['id']), c['name'], c['difficulty'], c['points'], category)
-                await asyncio.sleep(0.5)  # Petit délai pour éviter le flood
-        for m in all_content['machines']:
-            db.add_or_update_machine(str(m['id']), m['name'], m['difficulty'], m['points'], m.get('os', ''))
-        for f in all_content['fortresses']:
-            db.add_or_update_fortress(str(f['id']), f['name'], f.get('points', 0), f.get('flags', 0))
-        all_completed = {
-            'challenges': set(),
-            'machines': set(),
-            'fortresses': set()
-        }
-        all_completed_flags = {}  # {machine_id: set(['user', 'root'])}
+        # Enregistre challenges, machines et forteresses en base au fil de l'arrivée des pages ;
+        # seuls les (id, nom) sont gardés en mémoire pour construire la todo
+        names = {'challenges': {}, 'machines': {}, 'fortresses': {}}
+        profiling.mark('catalogue')
+        async for kind, records in self.htb_fetcher.iter_content():
+            if kind == 'challenges':
+                # Les challenges du catalogue n'ont pas de catégorie : celle déjà connue est conservée
+                await async_db.bulk_upsert_challenges(records)
+            elif kind == 'machines':
+                await async_db.bulk_upsert_machines(records)
+            else:
+                await async_db.bulk_upsert_fortresses(records)
+            names[kind].update((record.id, record.name) for record in records)
+        # Seules les catégories inconnues ou périmées sont redemandées à l'API
+        profiling.mark('catégories')
+        stale_ids = [cid for cid in await async_db.get_stale_challenge_ids(CATEGORY_TTL) if cid in names['challenges']]
+        logger.info("%d catégories de challenges à rafraîchir", len(stale_ids))
+        categories = await htb_client.gather_limited(fetch_challenge_category, stale_ids)
+        await async_db.bulk_update_challenge_categories([(cid, category)
+                                                         for cid, category in zip(stale_ids, categories) if category],
+                                                        CATEGORY_TTL_JITTER)
+        profiling.mark('activité des membres')
+        # L'activité est tenue à jour par check_member_progress : seul l'historique des
+        # membres encore absents de la table activity est téléchargé
+        known_users = await async_db.get_activity_user_ids()
         for user in self.university_users:
-            print(f"[*] Vérification des défis complétés par {user['name']}...")
-            user_completed = await self.get_user_completed_content(user['htb_id'])
-            for content_type in ['challenges', 'machines', 'fortresses']:
-                all_completed[content_type].update(user_completed[content_type])
-            # Pour chaque activité machine, récupérer les flags user/root
-            async with aiohttp.ClientSession(headers=headers) as session:
-                url = f"https://labs.hackthebox.com/api/v4/user/profile/activity/{user['htb_id']}"
-                async with session.get(url, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        activities = data.get('profile', {}).get('activity', [])
-                        for act in activities:
-                            if act.get('object_type') == 'machine':
-                                machine_id = str(act.get('id'))
-                                flag_type = act.get('type', None)
-                                if flag_type in ('user', 'root'):
-                                    all_completed_flags.setdefault(machine_id, set()).add(flag_type)
-        db.clear_todo()
-        for c in all_content['challenges']:
-            if str(c['id']) not in all_completed['challenges']:
-                db.add_todo('challenge', str(c['id']), c['name'])
-        for m in all_content['machines']:
-            machine_id = str(m['id'])
-            completed_flags = all_completed_flags.get(machine_id, set())
+            if user['htb_id'] not in known_users:
+                logger.debug("Récupération de l'historique de %s...", user['name'])
+                await async_db.bulk_add_activities(user['htb_id'], await self.get_user_activities(user['htb_id']))
+        all_completed = CompletedContent.from_activities(await async_db.get_solved_activities())
+        profiling.mark('todo')
+        todo_entries = []
+        for challenge_id, name in names['challenges'].items():
+            if challenge_id not in all_completed.challenges:
+                todo_entries.append(('challenge', challenge_id, name))
+        for machine_id, name in names['machines'].items():
+            completed_flags = all_completed.machine_flags.get(machine_id, set())
             if 'user' not in completed_flags:
-                db.add_todo('machine_user', machine_id, m['name'])
+                todo_entries.append(('machine_user', machine_id, name))
             if 'root' not in completed_flags:
-                db.add_todo('machine_root', machine_id, m['name'])
-        for f in all_content['fortresses']:
-            if str(f['id']) not in all_completed['fortresses']:
-                db.add_todo('fortress', str(f['id']), f['name'])
-        print("[+] Table todo mise à jour en base")
-        todo_rows = db.get_todo()
-        n_chal = len([x for x in todo_rows if x[0] == 'challenge'])
-        n_mach = len([x for x in todo_rows if x[0] == 'machine'])
-        n_fort = len([x for x in todo_rows if x[0] == 'fortress'])
-        print(f"[*] Résumé des défis restants:")
-        print(f"    - Challenges: {n_chal}")
-        print(f"    - Machines: {n_mach}")
-        print(f"    - Forteresses: {n_fort}")
+                todo_entries.append(('machine_root', machine_id, name))
+        for fortress_id, name in names['fortresses'].items():
+            if fortress_id not in all_completed.fortresses:
+                todo_entries.append(('fortress', fortress_id, name))
+        added, removed = await async_db.reconcile_todo(todo_entries)
+        logger.info("Table todo mise à jour en base (+%d / -%d)", added, removed)
+        todo_counts = await async_db.count_todo()
+        n_chal = todo_counts.get('challenge', 0)
+        n_mach = todo_counts.get('machine_user', 0) + todo_counts.get('machine_root', 0)
+        n_fort = todo_counts.get('fortress', 0)
+        logger.info("Défis restants: %d challenges, %d flags de machines, %d forteresses", n_chal, n_mach, n_fort,
+                    extra={'challenges': n_chal, 'machines': n_mach, 'fortresses': n_fort})
+        profiling.mark('publication discord')
         if DISCORD_TOKEN and client.is_ready():
-            print("[*] Envoi de la liste sur Discord...")
+            logger.info("Envoi de la liste sur Discord...")
             await self.send_todo_to_discord()
 
-    async def send_todo_to_discord(self):
+    async def send_todo_to_discord(self, categories=None):
+        """Publie la todo list ; seuls les messages des catégories données sont modifiés"""
+        categories = set(categories or TODO_CATEGORIES)
         try:
             channel = client.get_channel(DISCORD_TODO_CHANNEL_ID)
             if not channel:
-                print("[-] Impossible de trouver le channel TODO Discord")
+                logger.error("Impossible de trouver le channel TODO Discord")
                 return
 
-            todo_rows = db.get_todo()
-            if not todo_rows:
+            if not await async_db.count_todo():
                 await channel.send("Aucun défi à faire ! Félicitations à tous !")
                 return
 
@@ -386,15 +385,12 @@ class HTBUniversityTracker:
             }
 
             # --- CHALLENGES ---
-            challenges = [x for x in todo_rows if x[0] == 'challenge']
+            challenges = await async_db.todo_with_details('challenge') if 'challenges' in categories else []
             if challenges:
-                all_chal = {row[0]: row for row in db.get_all_challenges()}
                 cat_map = {}
-                for _, htb_id, name in challenges:
-                    chal = all_chal.get(htb_id, (htb_id, name, '?', 0, 'Inconnue'))
-                    _, cname, cdiff, cpts, ccat = chal
-                    ccat = ccat or 'Inconnue'
-                    cat_map.setdefault(ccat, []).append((cname, cdiff, cpts))
+                for htb_id, name, chal in challenges:
+                    chal = chal or Challenge(htb_id, name, '?', 0, 0)
+                    cat_map.setdefault(chal.category or 'Inconnue', []).append(chal)
 
                 embed = discord.Embed(
                     title="Challenges",
@@ -404,8 +400,8 @@ class HTBUniversityTracker:
                 embed.set_footer(text="HTB Univ tracker")
 
                 for cat, items in sorted(cat_map.items(), key=lambda x: len(x[1]), reverse=True):
-                    items_sorted = sorted(items, key=lambda x: int(x[2]) if str(x[2]).isdigit() else 0, reverse=True)
-                    lines = [f"{name} [{diff.split('(')[0].strip()}] - {pts//10}" for name, diff, pts in items_sorted]
+                    items_sorted = sorted(items, key=lambda c: c.points, reverse=True)
+                    lines = [f"{c.name} [{c.difficulty}] - {c.points // 10}" for c in items_sorted]
                     field_chunks = []
                     current = ""
                     for line in lines:
@@ -424,9 +420,10 @@ class HTBUniversityTracker:
 
             # --- MACHINES ---
             # Collect both user and root flags
-            machine_user = [x for x in todo_rows if x[0] == 'machine_user']
-            machine_root = [x for x in todo_rows if x[0] == 'machine_root']
-            machines = machine_user + machine_root
+            machines = []
+            if 'machines' in categories:
+                for t in ('machine_user', 'machine_root'):
+                    machines.extend((t, *row) for row in await async_db.todo_with_details(t))
             if machines:
                 embed = discord.Embed(
                     title="Machines",
@@ -435,22 +432,20 @@ class HTBUniversityTracker:
                 )
                 embed.set_footer(text="HTB Univ tracker")
 
-                all_mach = {row[0]: row for row in db.get_all_machines()}
                 # Group by machine and show which flags are missing
                 machine_flags = {}
-                for t, htb_id, name in machines:
+                for t, htb_id, name, mach in machines:
                     flag = "user" if t == "machine_user" else "root"
                     if htb_id not in machine_flags:
-                        machine_flags[htb_id] = {"name": name, "missing": []}
+                        machine_flags[htb_id] = {"name": name, "machine": mach, "missing": []}
                     machine_flags[htb_id]["missing"].append(flag)
                 for htb_id, info in machine_flags.items():
-                    mach = all_mach.get(htb_id)
+                    mach = info["machine"]
                     flags_str = ", ".join(info["missing"])
                     if mach:
-                        _, mname, mdiff, mpts, mos = mach
                         embed.add_field(
-                            name=mname,
-                            value=f"Difficulté: {mdiff}\nOS: {mos}\nPoints: {mpts}\nFlags à faire: {flags_str}",
+                            name=mach.name,
+                            value=f"Difficulté: {mach.difficulty_text}\nOS: {mach.os}\nPoints: {mach.points}\nFlags à faire: {flags_str}",
                             inline=False
                         )
                     else:
@@ -459,7 +454,7 @@ class HTBUniversityTracker:
                 embeds["machines"] = embed
 
             # --- FORTRESSES ---
-            fortresses = [x for x in todo_rows if x[0] == 'fortress']
+            fortresses = await async_db.todo_with_details('fortress') if 'forteresses' in categories else []
             if fortresses:
                 embed = discord.Embed(
                     title="Forteresses",
@@ -468,14 +463,11 @@ class HTBUniversityTracker:
                 )
                 embed.set_footer(text="HTB Univ tracker")
 
-                all_fort = {row[0]: row for row in db.get_all_fortresses()}
-                for _, htb_id, name in fortresses:
-                    fort = all_fort.get(htb_id)
+                for htb_id, name, fort in fortresses:
                     if fort:
-                        _, fname, fpts, fflags = fort
                         embed.add_field(
-                            name=fname,
-                            value=f"Points: {fpts}\nFlags: {fflags}",
+                            name=fort.name,
+                            value=f"Points: {fort.points}\nFlags: {fort.flags}",
                             inline=False
                         )
                     else:
@@ -483,38 +475,59 @@ class HTBUniversityTracker:
 
                 embeds["forteresses"] = embed
             
-            # Edit ou créer les messages dans le channel
-            for category in monitor_messages.keys():
-                if monitor_messages[category]:
-                    try:
-                        message = await channel.fetch_message(monitor_messages[category])
-                        await message.edit(embed=embeds[category])
-                    except discord.errors.NotFound:
-                        # Si le message n'existe plus, crée-en un nouveau
+            # Edit ou créer les messages dans le channel, seulement si leur contenu a changé
+            stored_messages = await async_db.get_monitor_messages()
+            for category in TODO_CATEGORIES:
+                if category not in categories:
+                    continue
+                content_hash = embed_hash(embeds[category])
+                message_id, previous_hash = stored_messages.get(category, (None, None))
+                if message_id and content_hash == previous_hash:
+                    continue
+                with metrics.discord_send_duration.time(kind='todo'):
+                    if message_id:
+                        try:
+                            message = await channel.get_partial_message(message_id).edit(embed=embeds[category])
+                        except discord.errors.NotFound:
+                            # Si le message n'existe plus, crée-en un nouveau
+                            message = await channel.send(embed=embeds[category])
+                    else:
+                        # Crée un nouveau message
                         message = await channel.send(embed=embeds[category])
-                        monitor_messages[category] = message.id
-                else:
-                    # Crée un nouveau message
-                    message = await channel.send(embed=embeds[category])
-                    monitor_messages[category] = message.id
+                metrics.discord_sends.inc(kind='todo', result='ok')
+                await async_db.set_monitor_message(category, message.id, content_hash)
 
-        except Exception as e:
-            print(f"[-] Erreur lors de l'envoi Discord TODO: {e}")
+        except Exception:
+            logger.exception("Erreur lors de l'envoi Discord TODO")
 
 @tasks.loop(time=time_21_1)
 async def daily_update():
     """Tâche quotidienne de mise à jour des défis"""
-    print("\n[*] Début de la mise à jour quotidienne...")
+    logger.info("Début de la mise à jour quotidienne...")
     tracker = HTBUniversityTracker()
-    await tracker.update_university_progress()
-    print("[+] Mise à jour terminée")
+    with metrics.track_loop('daily_update'):
+        await tracker.update_university_progress()
+    logger.info("Mise à jour terminée")
+
+def _handle_sigterm(signum, frame):
+    # docker stop envoie SIGTERM : on le traite comme un Ctrl+C pour que
+    # client.run rende la main et que la base soit fermée proprement
+    raise KeyboardInterrupt
 
 if __name__ == "__main__":
+    log.setup()
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     # Initialiser la base de données SQLite
     db.init_db()
     
     if DISCORD_TOKEN:
-        print("[*] Démarrage du bot Discord...")
-        client.run(DISCORD_TOKEN)
+        logger.info("Démarrage du bot Discord...")
+        try:
+            # Les logs de discord.py passent par la configuration de log.setup()
+            client.run(DISCORD_TOKEN, log_handler=None)
+        finally:
+            # client.close() a déjà fermé la session HTTP dans la boucle ; reste la base
+            async_db.close()
+            db.close_connection()
     else:
-        print("[!] Token Discord non configuré, mode bot désactivé")
\ No newline at end of file
+        logger.warning("Token Discord non configuré, mode bot désactivé")
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Compteurs et histogrammes en mémoire, exposés au format texte de Prometheus
+# sur http://<METRICS_HOST>:<METRICS_PORT>/metrics lorsque METRICS_PORT est défini.
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.environ.get('METRICS_PORT')
+
+# Bornes des histogrammes (en secondes), des requêtes unitaires aux boucles complètes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # Les métriques sont aussi mises à jour depuis le thread de la base
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} attend les labels {self.label_names}, reçu {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [compteurs par borne..., somme, nombre]}
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mesure la durée du bloc, y compris s'il lève une exception"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        names = self.label_names + ('le',)
+        for key, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {int(count)}"
+            yield f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {int(state[-1])}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {int(state[-1])}"
+
+_registry: List[_Metric] = []
+
+def render() -> str:
+    """Toutes les métriques au format texte de Prometheus"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+# --- Métriques du bot ---
+htb_requests = Counter('htb_requests_total', "Requêtes vers l'API HTB par endpoint et statut", ('endpoint', 'status'))
+htb_request_duration = Histogram('htb_request_duration_seconds', "Durée des requêtes vers l'API HTB", ('endpoint',))
+htb_cache = Counter('htb_cache_total', "Réponses servies par le cache HTTP", ('result',))
+htb_rate_limit = Gauge('htb_rate_limit_requests_per_second', "Débit courant autorisé par le limiteur")
+db_operation_duration = Histogram('db_operation_duration_seconds', "Durée des appels à db.py", ('operation',))
+db_operation_errors = Counter('db_operation_errors_total', "Appels à db.py ayant levé une exception", ('operation',))
+discord_sends = Counter('discord_sends_total', "Envois et modifications de messages Discord", ('kind', 'result'))
+discord_send_duration = Histogram('discord_send_duration_seconds', "Durée des envois Discord", ('kind',))
+loop_iterations = Counter('loop_iterations_total', "Itérations des tâches périodiques", ('loop', 'result'))
+loop_duration = Histogram('loop_iteration_duration_seconds', "Durée des itérations des tâches périodiques", ('loop',))
+member_polls = Counter('member_polls_total', "Sondages de l'activité des membres", ('result',))
+poll_backlog = Gauge('member_poll_backlog', "Membres à sonder reportés faute de budget")
+loop_lag = Histogram('event_loop_lag_seconds', "Retard de réveil de la boucle asyncio",
+                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+loop_lag_current = Gauge('event_loop_lag_current_seconds', "Dernier retard mesuré de la boucle asyncio")
+loop_blocks = Counter('event_loop_blocks_total', "Blocages de la boucle asyncio au-delà du seuil")
+
+@contextmanager
+def track_loop(loop: str):
+    """Compte et chronomètre une itération de tâche périodique"""
+    result = 'error'
+    try:
+        with loop_duration.time(loop=loop):
+            yield
+        result = 'ok'
+    finally:
+        loop_iterations.inc(loop=loop, result=result)
+
+# --- Exposition HTTP ---
+_runner: Optional[web.AppRunner] = None
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def start_server(port: Optional[int] = None, host: str = METRICS_HOST) -> bool:
+    """Démarre l'endpoint /metrics ; sans port ni METRICS_PORT, ne fait rien"""
+    global _runner
+    if port is None:
+        if not METRICS_PORT:
+            return False
+        port = int(METRICS_PORT)
+    if _runner is not None:
+        return True
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+    logger.info("Métriques exposées sur http://%s:%d/metrics", host, port)
+    return True
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
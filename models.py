@@ -0,0 +1,178 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+# Enregistrements partagés par le fetcher, db.py et les embeds Discord.
+# Les NamedTuple n'ont pas de __dict__ par instance et se construisent
+# directement depuis une ligne SQLite.
+
+def to_int(value, default: int = 0) -> int:
+    try:
+        return int(str(value).strip() or default)
+    except (TypeError, ValueError):
+        return default
+
+def to_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+class Challenge(NamedTuple):
+    id: str
+    name: str
+    difficulty: str
+    difficulty_score: int
+    points: int
+    category: Optional[str] = None
+    retired: bool = False
+    rating: float = 0.0
+    solves: int = 0
+    release_date: Optional[str] = None
+
+    @classmethod
+    def from_api(cls, c: dict) -> "Challenge":
+        return cls(
+            id=str(c.get('id')),
+            name=c.get('name', 'Inconnu'),
+            difficulty=c.get('difficulty', 'Inconnu'),
+            difficulty_score=to_int(c.get('avg_difficulty', 0)),
+            points=to_int(c.get('points', 0)),
+            retired=bool(c.get('retired', False)),
+            rating=to_float(c.get('rating', 0)),
+            solves=to_int(c.get('solves', 0)),
+            release_date=c.get('release_date')
+        )
+
+    @property
+    def difficulty_text(self) -> str:
+        return f"{self.difficulty} ({self.difficulty_score}/100)"
+
+    @property
+    def status(self) -> str:
+        return 'Retraité' if self.retired else 'Actif'
+
+class Machine(NamedTuple):
+    id: str
+    name: str
+    difficulty: str
+    difficulty_score: int
+    points: int
+    os: str
+    free: bool = False
+    tags: Tuple[str, ...] = ()
+    rating: float = 0.0
+    solves: int = 0
+    release_date: Optional[str] = None
+
+    @classmethod
+    def from_api(cls, m: dict) -> "Machine":
+        # Créer un tag pour les machines spéciales
+        tags = []
+        if m.get('is_competitive'):
+            tags.append('COMPETITIVE')
+        if m.get('labels'):
+            tags.extend(label['name'] for label in m['labels'])
+        return cls(
+            id=str(m.get('id')),
+            name=m.get('name', 'Inconnu'),
+            difficulty=m.get('difficultyText', 'Inconnu'),
+            difficulty_score=to_int(m.get('difficulty', 0)),
+            points=int(m.get('points', 0)),
+            os=m.get('os', 'Inconnu'),
+            free=bool(m.get('free', False)),
+            tags=tuple(tags),
+            rating=to_float(m.get('star', 0)),
+            solves=to_int(m.get('user_owns_count', 0)),
+            release_date=m.get('release')
+        )
+
+    @property
+    def difficulty_text(self) -> str:
+        return f"{self.difficulty} ({self.difficulty_score}/100)"
+
+    @property
+    def status(self) -> str:
+        status_parts = [self.os]
+        if self.tags:
+            status_parts.append(f"[{', '.join(self.tags)}]")
+        status_parts.append('Gratuit' if self.free else 'VIP')
+        return ' - '.join(status_parts)
+
+class Fortress(NamedTuple):
+    id: str
+    name: str
+    points: int
+    flags: int
+    new: bool = False
+
+    @classmethod
+    def from_api(cls, f: dict) -> "Fortress":
+        return cls(
+            id=str(f.get('id')),
+            name=f.get('name', 'Inconnu'),
+            points=to_int(f.get('points', 0)),
+            flags=to_int(f.get('number_of_flags', 0)),
+            new=bool(f.get('new', False))
+        )
+
+    # Colonnes communes avec challenges et machines pour l'affichage en tableau
+    @property
+    def difficulty_text(self) -> str:
+        return f"Drapeaux: {self.flags}"
+
+    @property
+    def status(self) -> str:
+        return 'Nouveau' if self.new else 'Standard'
+
+    rating = 0.0
+    solves = 0
+    release_date = None
+
+class Activity(NamedTuple):
+    """Une entrée de /user/profile/activity"""
+    object_type: str
+    id: str
+    type: str  # user / root pour les machines
+    name: str
+    points: int
+    date: str
+    challenge_category: str
+
+    @classmethod
+    def from_api(cls, act: dict) -> "Activity":
+        return cls(
+            object_type=act.get('object_type', ''),
+            id=str(act.get('id', '0')),
+            type=str(act.get('type') or ''),
+            name=act.get('name', 'Inconnu'),
+            points=to_int(act.get('points', 0)),
+            date=act.get('date') or '',
+            challenge_category=act.get('challenge_category') or 'Unknown'
+        )
+
+    @property
+    def key(self) -> Tuple[str, str, str, str]:
+        """Identifiant de l'activité : (object_type, id, type, date)"""
+        return (self.object_type, self.id, self.type, self.date)
+
+@dataclass
+class CompletedContent:
+    """Contenus complétés par au moins un membre de l'université"""
+    challenges: Set[str] = field(default_factory=set)
+    machines: Set[str] = field(default_factory=set)
+    machine_flags: Dict[str, Set[str]] = field(default_factory=dict)  # {machine_id: {'user', 'root'}}
+    fortresses: Set[str] = field(default_factory=set)
+
+    @classmethod
+    def from_activities(cls, activities: List[Activity]) -> "CompletedContent":
+        record = cls()
+        for act in activities:
+            if act.object_type == 'challenge':
+                record.challenges.add(act.id)
+            elif act.object_type == 'machine':
+                record.machines.add(act.id)
+                if act.type in ('user', 'root'):
+                    record.machine_flags.setdefault(act.id, set()).add(act.type)
+            elif act.object_type == 'fortress':
+                record.fortresses.add(act.id)
+        return record
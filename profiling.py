@@ -0,0 +1,112 @@
+import io
+import os
+import asyncio
+import time
+import logging
+import pstats
+import cProfile
+import functools
+import contextvars
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Profilage à la demande des itérations longues, activé par variable d'environnement :
+#   HTB_PROFILE=update_university_progress,check_member_progress  (ou "all")
+#   HTB_PROFILE_RUNS=1  nombre d'itérations profilées par cible
+PROFILE_TARGETS = {name.strip() for name in os.environ.get('HTB_PROFILE', '').split(',') if name.strip()}
+PROFILE_RUNS = int(os.environ.get('HTB_PROFILE_RUNS', '1'))
+PROFILE_DIR = Path("data/profiles")
+# Nombre de fonctions listées dans le rapport
+REPORT_LIMIT = 40
+
+_runs = {}
+# cProfile n'accepte qu'un profileur actif à la fois par thread
+_active = False
+_current: contextvars.ContextVar = contextvars.ContextVar('profile', default=None)
+
+class Profile:
+    """Une itération profilée : cProfile sur tout le thread de la boucle, plus un
+    découpage en phases (temps réel et temps CPU du processus)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.phases: List[Tuple[str, float, float]] = []
+        self._phase: Optional[Tuple[str, float, float]] = None
+
+    def mark(self, phase: Optional[str]):
+        """Termine la phase en cours et démarre la suivante"""
+        now = (time.perf_counter(), time.process_time())
+        if self._phase is not None:
+            name, wall, cpu = self._phase
+            self.phases.append((name, now[0] - wall, now[1] - cpu))
+        self._phase = (phase, *now) if phase else None
+
+    def report(self) -> str:
+        out = io.StringIO()
+        out.write(f"Profil de {self.name} du {datetime.now().isoformat(timespec='seconds')}\n\n")
+        # Un temps réel très supérieur au temps CPU indique une phase passée à attendre (réseau, base)
+        out.write(f"{'Phase':<24}{'Réel (s)':>12}{'CPU (s)':>12}\n")
+        for phase, wall, cpu in self.phases:
+            out.write(f"{phase:<24}{wall:>12.3f}{cpu:>12.3f}\n")
+        total_wall = sum(wall for _, wall, _ in self.phases)
+        total_cpu = sum(cpu for _, _, cpu in self.phases)
+        out.write(f"{'total':<24}{total_wall:>12.3f}{total_cpu:>12.3f}\n\n")
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LIMIT)
+        return out.getvalue()
+
+    def save(self) -> Path:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        base = PROFILE_DIR / f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        # .prof exploitable avec pstats ou snakeviz, .txt lisible directement
+        self.profiler.dump_stats(f"{base}.prof")
+        report = base.with_suffix('.txt')
+        report.write_text(self.report(), encoding='utf-8')
+        return report
+
+def mark(phase: str):
+    """Découpe l'itération profilée en cours ; sans profilage actif, ne fait rien"""
+    profile = _current.get()
+    if profile is not None:
+        profile.mark(phase)
+
+def _should_profile(name: str) -> bool:
+    if name not in PROFILE_TARGETS and 'all' not in PROFILE_TARGETS:
+        return False
+    if _active or _runs.get(name, 0) >= PROFILE_RUNS:
+        return False
+    _runs[name] = _runs.get(name, 0) + 1
+    return True
+
+def profiled(name: str):
+    """Décorateur de coroutine : profile les HTB_PROFILE_RUNS premiers appels si name est ciblé
+
+    cProfile observe tout le thread de la boucle : les autres tâches actives
+    pendant l'itération apparaissent aussi dans le rapport.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            global _active
+            if not _should_profile(name):
+                return await func(*args, **kwargs)
+            profile = Profile(name)
+            _active = True
+            token = _current.set(profile)
+            profile.mark('début')
+            profile.profiler.enable()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profile.profiler.disable()
+                profile.mark(None)
+                _current.reset(token)
+                _active = False
+                # dump_stats et le rapport pstats sont bloquants : écrits hors de la boucle
+                logger.info("Profil de %s écrit dans %s", name, await asyncio.to_thread(profile.save))
+        return wrapper
+    return decorator
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+class TokenBucket:
+    """Limiteur de débit à jetons partagé entre toutes les coroutines"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        # Créé à la première utilisation pour être lié à la boucle de discord.py
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _wait(self):
+        """Point d'extension pour suspendre la distribution de jetons"""
+
+    async def acquire(self):
+        """Attend qu'un jeton soit disponible puis le consomme"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                await self._wait()
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Convertit un en-tête Retry-After (secondes ou date HTTP) en secondes"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+def parse_rate_limit_reset(value: Optional[str]) -> Optional[float]:
+    """Convertit X-RateLimit-Reset (timestamp epoch ou délai) en secondes"""
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    # Au-delà d'un milliard il s'agit d'un timestamp epoch
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket dont le débit s'adapte aux réponses de l'API (AIMD)
+
+    Chaque réponse réussie augmente le débit de façon additive, chaque 429
+    le divise et suspend les requêtes pendant la durée demandée par le serveur.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0.2, max_rate: float = 10,
+                 increase: float = 0.1, decrease: float = 0.5, max_pause: float = 60):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_pause = max_pause
+        self._paused_until = 0.0
+
+    async def _wait(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            self._last_refill = time.monotonic()
+
+    def _pause(self, seconds: float):
+        seconds = min(seconds, self.max_pause)
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._last_refill = time.monotonic()
+
+    def on_success(self, response_headers: Optional[Mapping[str, str]] = None):
+        """Augmentation additive, bornée par max_rate et les en-têtes du serveur"""
+        self.rate = min(self.max_rate, self.rate + self.increase)
+        if response_headers is None:
+            return
+        remaining = response_headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            reset = parse_rate_limit_reset(response_headers.get('X-RateLimit-Reset'))
+            self._pause(reset if reset is not None else 1 / self.rate)
+
+    def on_throttle(self, response_headers: Optional[Mapping[str, str]] = None):
+        """Diminution multiplicative après un 429 et pause selon Retry-After"""
+        now = time.monotonic()
+        # Les 429 reçus pendant une pause déjà en cours ne réduisent pas à nouveau le débit
+        if now >= self._paused_until:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        delay = None
+        if response_headers is not None:
+            delay = parse_retry_after(response_headers.get('Retry-After'))
+            if delay is None:
+                delay = parse_rate_limit_reset(response_headers.get('X-RateLimit-Reset'))
+        self._pause(delay if delay is not None else 1 / self.rate)
@@ -0,0 +1,70 @@
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+import async_db
+import htb_client
+import http_cache
+
+logger = logging.getLogger(__name__)
+
+UNIVERSITY_ID = 518
+
+class Roster:
+    """Liste des membres de l'université, gardée en mémoire entre deux sondages
+
+    Tant que le TTL de l'entrée du cache HTTP n'est pas expiré, la liste en mémoire
+    est retournée telle quelle. Ensuite, tant que l'empreinte du corps enregistrée
+    par le cache est inchangée (304 ou même contenu), rien n'est recalculé.
+    Seuls les membres dont le nom, le rang ou l'avatar a changé sont écrits en base ;
+    ceux qui ont quitté l'université en sont retirés avec leur activité.
+    """
+
+    def __init__(self, ttl: float = htb_client.MEMBERS_TTL):
+        self.ttl = ttl
+        self.url = f"{htb_client.LABS_API}/university/members/{UNIVERSITY_ID}"
+        self.members: List[dict] = []
+        self._loaded = False
+        self._digest: Optional[str] = None
+        self._known: Optional[Dict[str, Tuple[str, str, str]]] = None
+
+    async def get_members(self, retries: int = 1) -> Optional[List[dict]]:
+        """Retourne les membres, ou None si l'API n'a jamais répondu"""
+        entry = http_cache.get_entry(self.url)
+        # Tant que le TTL court, les métadonnées en mémoire suffisent : ni lecture disque ni requête
+        if self._loaded and entry is not None and time.time() - entry.fetched_at < self.ttl:
+            return self.members
+        data = await htb_client.get_json_cached(self.url, self.ttl, retries=retries)
+        if data is None:
+            return self.members if self._loaded else None
+        entry = http_cache.get_entry(self.url)
+        digest = entry.digest if entry is not None else None
+        if not self._loaded or digest is None or digest != self._digest:
+            await self._sync(data)
+            self.members = data
+            self._digest = digest
+            self._loaded = True
+        return self.members
+
+    async def _sync(self, data: List[dict]):
+        if self._known is None:
+            self._known = {row[0]: tuple(row[1:]) for row in await async_db.get_all_users()}
+        changed = []
+        for member in data:
+            member_id = str(member['id'])
+            values = (member['name'], member.get('rank_text') or '', member.get('avatar') or '')
+            if self._known.get(member_id) != values:
+                changed.append((member_id, *values))
+                self._known[member_id] = values
+        if changed:
+            await async_db.bulk_upsert_users(changed)
+            logger.info("%d membres ajoutés ou modifiés en base", len(changed))
+        # Les flags d'un ancien membre ne doivent plus bloquer la todo ni les first bloods.
+        # Une liste vide est ignorée : elle signale plus sûrement une réponse anormale qu'un départ général
+        departed = self._known.keys() - {str(member['id']) for member in data} if data else set()
+        if departed:
+            await async_db.remove_users(departed)
+            for member_id in departed:
+                del self._known[member_id]
+            logger.info("%d anciens membres retirés de la base", len(departed))
+
+roster = Roster()
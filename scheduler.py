@@ -0,0 +1,93 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+import metrics
+
+# Sondage adaptatif des membres : les membres actifs récemment sont sondés souvent,
+# les autres de plus en plus rarement, sans dépasser l'intervalle maximal
+# (borne de fraîcheur) ni le budget global de requêtes.
+TICK_SECONDS = 30
+MIN_INTERVAL = float(os.environ.get('HTB_POLL_MIN_INTERVAL', '60'))
+MAX_INTERVAL = float(os.environ.get('HTB_POLL_MAX_INTERVAL', '1800'))
+# Nombre maximal de sondages d'activité par minute, tous membres confondus
+POLL_BUDGET = float(os.environ.get('HTB_POLL_BUDGET', '30'))
+# Un membre ayant une activité plus récente que cette durée est considéré actif
+ACTIVE_WINDOW = 24 * 3600
+BACKOFF = 2
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    """Date ISO de l'API HTB -> timestamp, ou None si absente ou illisible"""
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+@dataclass
+class MemberState:
+    interval: float
+    next_due: float
+    last_activity: Optional[float] = None
+
+class PollScheduler:
+    def __init__(self, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL,
+                 budget: float = POLL_BUDGET, tick: float = TICK_SECONDS):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.tick = tick
+        # Sondages autorisés par passage de la boucle
+        self.per_tick = max(1, int(budget * tick / 60))
+        self.members: Dict[str, MemberState] = {}
+
+    def seed(self, last_activities: Dict[str, str]):
+        """Initialise les dates de dernière activité connues (table activity)"""
+        for member_id, date in last_activities.items():
+            state = self.members.get(member_id)
+            if state is None:
+                state = self.members[member_id] = MemberState(self.min_interval, 0)
+            state.last_activity = parse_date(date)
+            # Premier sondage immédiat ; les membres inactifs repartent ensuite directement à l'intervalle maximal
+            if not self._is_active(state, time.time()):
+                state.interval = self.max_interval
+
+    def _is_active(self, state: MemberState, now: float) -> bool:
+        return state.last_activity is not None and now - state.last_activity < ACTIVE_WINDOW
+
+    def due(self, member_ids: Iterable[str]) -> List[str]:
+        """Membres à sonder maintenant, les plus en retard d'abord, dans la limite du budget"""
+        now = time.time()
+        current = set(member_ids)
+        for member_id in self.members.keys() - current:
+            del self.members[member_id]
+        for member_id in current - self.members.keys():
+            self.members[member_id] = MemberState(self.min_interval, 0)
+        due = sorted((state.next_due, member_id) for member_id, state in self.members.items() if state.next_due <= now)
+        selected = [member_id for _, member_id in due[:self.per_tick]]
+        metrics.poll_backlog.set(len(due) - len(selected))
+        return selected
+
+    def record(self, member_id: str, ok: bool, last_activity: Optional[str] = None):
+        """Planifie le prochain sondage d'un membre d'après le résultat du dernier"""
+        state = self.members.get(member_id)
+        if state is None:
+            return
+        now = time.time()
+        if ok:
+            activity = parse_date(last_activity)
+            if activity is not None and (state.last_activity is None or activity > state.last_activity):
+                state.last_activity = activity
+            if self._is_active(state, now):
+                state.interval = self.min_interval
+            else:
+                state.interval = min(state.interval * BACKOFF, self.max_interval)
+        # En cas d'échec l'intervalle est conservé : le membre sera réessayé au même rythme
+        state.next_due = now + state.interval
+        metrics.member_polls.inc(result='ok' if ok else 'error')
+
+scheduler = PollScheduler()